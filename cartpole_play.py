@@ -56,9 +56,10 @@ Copyright & Disclaimer:
 """
 import numpy as np
 from time import time
-import gym, random, numba
+import random
 
 from sdr_value_map import ValueCorrMap # The magic ingredient
+from scalar_encoder import ScalarEncoder
 
 SDR_SIZE  = 100  
 SDR_BITS  =   4  # Number of ON bits for each state parameter
@@ -67,29 +68,12 @@ LEFT,RIGHT = 0,1
 NUM_EPISODES = 1000 
 EMPTY_SDR = np.array([], dtype = np.uint32)
 
-@numba.jit
-def sdr_encoder(state, minims, maxims):
-    sdr_starts  = ( np.arange(STATE_SIZE) * SDR_SIZE // STATE_SIZE).astype(np.uint32)
-    sdr_widths  = np.array([sdr_starts[1]-SDR_BITS] * 4, dtype = np.uint32)
-    sdr_bits = np.array([SDR_BITS]*STATE_SIZE, dtype = np.uint32)
-    sdr = []
-    ranges = (maxims - minims)
-    values = state - minims
-    # print(ranges, values)
-    for i, val in enumerate(state):
-        rang, val = ranges[i], values[i]
-        width = int(sdr_widths[i] * val / rang)
-        
-        for k in range(sdr_bits[i]):
-           sdr.append(width + k + sdr_starts[i])
-    return np.array(sdr, dtype=np.uint32)
-
-@numba.jit
-def min_max_adjust(state, minims, maxims):
-    where = np.where(state < minims)
-    minims[where] = state[where]
-    where = np.where(state > maxims)
-    maxims[where] = state[where]
+def state_encoder():
+    """
+    Each state parameter gets SDR_BITS ON bits in its own quarter of the SDR,
+    ranges start at -0.1 +0.1 and widen to the states seen
+    """
+    return ScalarEncoder(STATE_SIZE, SDR_SIZE, SDR_BITS, minims = -0.1, maxims = 0.1)
 
 class SDR_Proxy_Player:
     # This is a wrapper over an actual player. 
@@ -100,13 +84,11 @@ class SDR_Proxy_Player:
     # 
     def __init__(self, player):
         # initial values for all state parameters are within -0.1 +0.1 range
-        self.maxims =  0.1 * np.ones(4)
-        self.minims = - self.maxims.copy()
+        self.encoder = state_encoder()
         self.player = player
 
     def policy(self, state, reward, done):
-        min_max_adjust(state, self.minims, self.maxims)
-        sdr = sdr_encoder(state, self.minims, self.maxims)
+        sdr = self.encoder.encode_one(state, adapt = True)
         return self.player.policy(sdr,reward,done)
 
 class AvoidantPlayer(): 
@@ -162,6 +144,7 @@ class AvoidantPlayer():
     
 
 def cartpole_play(policy, n_episodes):
+    import gym
     cp = gym.make('CartPole-v1')
     for  ep in range(n_episodes):
         state = cp.reset()
@@ -180,14 +163,15 @@ def cartpole_play(policy, n_episodes):
         yield ep, rtotal,istate, steps       
 
 
-player = SDR_Proxy_Player(AvoidantPlayer())
-t = time()
-total_steps = 0
-hoorays = 0
-for ep,total_reward,istate,steps in cartpole_play(player.policy, NUM_EPISODES):
-    print(f"{ep+1:4d}: steps: {len(steps):3d}")
-    if len(steps) == 500: 
-        hoorays += 1
-    total_steps += len(steps)
-t = int((time() - t)*1000)
-print(f"Play {total_steps} steps in {t}ms, hoorays:{hoorays}")
+if __name__ == "__main__":
+    player = SDR_Proxy_Player(AvoidantPlayer())
+    t = time()
+    total_steps = 0
+    hoorays = 0
+    for ep,total_reward,istate,steps in cartpole_play(player.policy, NUM_EPISODES):
+        print(f"{ep+1:4d}: steps: {len(steps):3d}")
+        if len(steps) == 500: 
+            hoorays += 1
+        total_steps += len(steps)
+    t = int((time() - t)*1000)
+    print(f"Play {total_steps} steps in {t}ms, hoorays:{hoorays}")
@@ -0,0 +1,178 @@
+"""
+Headless, vectorized CartPole for cartpole_play.py's fear driven agent.
+
+VecCartPole steps many CartPole-v1 environments at once with numpy, same dynamics,
+termination and 500 steps limit as gym's, no rendering and no gym needed.
+
+BatchAvoidantPlayer is AvoidantPlayer + SDR_Proxy_Player for all environments at once:
+    - all states are encoded in one ScalarEncoder.encode() call, with min/max ranges
+      adjusted in bulk
+    - both fear maps score all SDRs with score_many()
+    - each environment keeps only its last DANGER_STEPS (sdr, action) steps, and
+      deaths in the same step are added to the fear maps with add_many()
+All environments share the two fear maps, so experience of each one is learned by all.
+
+    $ python3 cartpole_vec.py
+"""
+import numpy as np
+from time import time
+
+from sdr_value_map import ValueCorrMap
+from cartpole_play import SDR_SIZE, LEFT, RIGHT, state_encoder
+
+DANGER_STEPS = 18   # steps before death which are added to fear maps
+SUCCESS = 490       # episodes longer than this are not scary
+
+class VecCartPole:
+    """
+    n_envs CartPole-v1 environments. step() resets finished environments itself
+    on the following call, so callers see every terminal state once.
+    """
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5            # half the pole's length
+    polemass_length = masspole * length
+    force_mag = 10.0
+    tau = 0.02              # seconds between state updates
+    theta_threshold = 12 * 2 * np.pi / 360
+    x_threshold = 2.4
+
+    def __init__(self, n_envs, max_steps = 500, seed = None):
+        self.n_envs = n_envs
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+        self.states = np.empty((n_envs, 4))
+        self.steps = np.zeros(n_envs, dtype = np.int64)
+        self.done = np.zeros(n_envs, dtype = bool)
+        self.reset()
+
+    def reset(self, which = None):
+        """
+        resets all environments or only those selected by which (bool mask or indices)
+        """
+        which = np.arange(self.n_envs) if which is None else which
+        n = self.states[which].shape[0]
+        self.states[which] = self.rng.uniform(-0.05, 0.05, size = (n, 4))
+        self.steps[which] = 0
+        self.done[which] = False
+        return self.states
+
+    def step(self, actions):
+        """
+        advances all environments, actions is an array of LEFT/RIGHT.
+        Environments done in the previous step are reset first and their action ignored.
+        returns states, done mask, and the episode lengths of environments just finished (0 for others)
+        """
+        if self.done.any():
+            self.reset(self.done)
+        x, x_dot, theta, theta_dot = self.states.T
+        force = np.where(actions == RIGHT, self.force_mag, -self.force_mag)
+        costheta, sintheta = np.cos(theta), np.sin(theta)
+        temp = (force + self.polemass_length * theta_dot ** 2 * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / (
+            self.length * (4.0 / 3.0 - self.masspole * costheta ** 2 / self.total_mass))
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+
+        # euler, same update order as gym
+        x += self.tau * x_dot
+        x_dot += self.tau * xacc
+        theta += self.tau * theta_dot
+        theta_dot += self.tau * thetaacc
+
+        self.steps += 1
+        self.done = ((np.abs(x) > self.x_threshold) | (np.abs(theta) > self.theta_threshold)
+                     | (self.steps >= self.max_steps))
+        lengths = np.where(self.done, self.steps, 0)
+        return self.states, self.done, lengths
+
+class BatchAvoidantPlayer:
+    """
+    see module doc. policy() takes all states and done flags, returns all actions
+    """
+    def __init__(self, n_envs, danger_steps = DANGER_STEPS, seed = None):
+        self.dangers = [ValueCorrMap(sdr_size = SDR_SIZE) for _ in (LEFT, RIGHT)]
+        self.encoder = state_encoder()
+        self.danger_steps = danger_steps
+        self.rng = np.random.default_rng(seed)
+        self.sdrs = np.empty((n_envs, self.encoder.sdr_len), dtype = np.uint32)
+        # ring buffers of the last danger_steps steps of each environment
+        self.hist_sdrs = np.empty((n_envs, danger_steps, self.encoder.sdr_len), dtype = np.uint32)
+        self.hist_actions = np.empty((n_envs, danger_steps), dtype = np.int64)
+        self.hist_len = np.zeros(n_envs, dtype = np.int64)
+        self.rewards = np.zeros(n_envs, dtype = np.int64)
+        self.hoorays = 0
+
+    def least_danger(self, sdrs):
+        scores = np.stack([danger.score_many(sdrs) for danger in self.dangers])
+        e = 0.00001
+        close = scores.max(axis = 0) / (scores.min(axis = 0) + e) < 1.01
+        actions = (scores[LEFT] > scores[RIGHT]).astype(np.int64)
+        return np.where(close, self.rng.integers(0, 2, size = len(sdrs)), actions)
+
+    def policy(self, states, done):
+        sdrs = self.encoder.encode(states, adapt = True, out = self.sdrs)
+        actions = self.least_danger(sdrs)
+
+        pos = self.hist_len % self.danger_steps
+        envs = np.arange(len(states))
+        self.hist_sdrs[envs, pos] = sdrs
+        self.hist_actions[envs, pos] = actions
+        self.hist_len += 1
+        self.rewards += ~done
+
+        if done.any():
+            self.update_dangers(np.flatnonzero(done))
+        return actions
+
+    def update_dangers(self, ended):
+        # like AvoidantPlayer.update_dangers() for all environments which ended this step
+        success = self.rewards[ended] > SUCCESS
+        self.hoorays += success.sum()
+        died = ended[~success]
+        if died.size:
+            back = np.minimum(self.hist_len[died], self.danger_steps)
+            # k steps back from the last one, the last one gets danger_steps
+            k = np.arange(self.danger_steps)
+            envs = np.repeat(died, back)
+            ks = np.concatenate([k[:b] for b in back])
+            pos = (self.hist_len[envs] - 1 - ks) % self.danger_steps
+            sdrs = self.hist_sdrs[envs, pos]
+            actions = self.hist_actions[envs, pos]
+            values = self.danger_steps - ks
+            for action in (LEFT, RIGHT):
+                which = actions == action
+                if which.any():
+                    self.dangers[action].add_many(sdrs[which], values[which])
+        self.hist_len[ended] = 0
+        self.rewards[ended] = 0
+
+def vec_cartpole_play(n_envs = 256, n_episodes = 10000, seed = None, max_steps = 500):
+    """
+    plays until n_episodes have finished across all environments.
+    returns the player and a list with the length of each finished episode
+    """
+    env = VecCartPole(n_envs, max_steps = max_steps, seed = seed)
+    player = BatchAvoidantPlayer(n_envs, seed = seed)
+    states, done = env.states, env.done
+    lengths = []
+    while len(lengths) < n_episodes:
+        actions = player.policy(states, done)
+        states, done, ended = env.step(actions)
+        lengths.extend(ended[done])
+    return player, lengths[:n_episodes]
+
+if __name__ == "__main__":
+    N_ENVS = 256
+    N_EPISODES = 20000
+    vec_cartpole_play(4, 10, seed = 0)   # give numba time to compile
+    t = time()
+    player, lengths = vec_cartpole_play(N_ENVS, N_EPISODES, seed = 1)
+    t = time() - t
+    lengths = np.array(lengths)
+    print(f"{N_EPISODES} episodes, {lengths.sum()} steps in {int(t*1000)}ms "
+          f"({int(N_EPISODES / t)} episodes/s, {int(lengths.sum() / t)} steps/s), hoorays:{player.hoorays}")
+    for start in range(0, N_EPISODES, N_EPISODES // 10):
+        chunk = lengths[start:start + N_EPISODES // 10]
+        print(f"episodes {start:6d}+: mean steps {chunk.mean():6.1f}, full {(chunk >= 500).mean()*100:5.1f}%")
@@ -10,10 +10,10 @@ Accuracy losses may be caused by both FHEncoder and associative memory overlaps.
 """
 from sdr_mem2d import SDRMap
 from fly_hash_encoder import FHEncoder
-from load_mnist_data import x_train, x_test, y_train, y_test, normalize
+from sdr_pipeline import vote
+from load_mnist_data import x_train, x_test, y_train, y_test
 
-x_train = normalize(x_train) # Our normalize aranges all images flattened and all image sum()-s are 1.0 
-x_test  = normalize(x_test)
+# FHEncoder takes the raw uint8 (28, 28) digits, no need for float normalized copies of the dataset
 
 import numpy as np
 from time import time
@@ -43,11 +43,11 @@ print(f"Will use sdr lengths for storage: {store_sdr_len}; for query: {query_sdr
 smap = SDRMap(sdr_size = SDR_size,slot_size = SLOT_size)
 # Create a FlyHash encoder. The hasher converts a alist of MNIST image to a SDR list of size 2048
 print(f"Generate Flyhash encoder, spread={pixel_spread}...")
-hasher = FHEncoder(sdr_size = SDR_size, random_seed = 3, spread = pixel_spread)
+hasher = FHEncoder(sdr_size = SDR_size, random_seed = 3, spread = pixel_spread, sparse = True)
 
 print(f"hasher initialised, we use it to convert {ilen} x_train images to SDRs")
 t = time()
-sdrs = hasher.compute_sdrs(x_train[istart:iend],sdr_len = store_sdr_len)
+sdrs = hasher.encode_parallel(x_train[istart:iend],sdr_len = store_sdr_len)
 t = time() - t
 print(f"{ilen} sdrs computed in {int(t*1000)}ms")
 print(f"Training sdrs.shape:{sdrs.shape}, dtype:{sdrs.dtype}")
@@ -73,22 +73,15 @@ xtest = x_test
 ytest = y_test
 print("Begin querrying memory map with x_test")
 t=time()
-sdrs = hasher.compute_sdrs(xtest, sdr_len=query_sdr_len)
+sdrs = hasher.encode_parallel(xtest, sdr_len=query_sdr_len)
 idlists, idcounts = smap.query(sdrs,first=8)
 t = time()-t
 print(f"Associative query {len(idlists)} done in {int(t*1000)}ms")
 
 print(f"\nNext we retrieve predicted digit numbers from the responses")
 t = time()
-idresults = []
-
-for idlist, idcount in zip(idlists, idcounts):
-    results = np.zeros(10)
-    for i in range(len(idlist)):
-        pred = idlist[i] % 100 # restore digit value from id.
-        results[pred] += idcount[i]
-    idresults.append(np.argmax(results))
-idresults = np.array(idresults)
+# vectorized vote, the digit value is recovered from each id's last two decimals
+idresults, _ = vote(idlists, idcounts, lambda ids: ids % 100, 10)
 # print(f"idresults.sum() {idresults.sum()}, dtype={idresults.dtype}")
 
 comps = idresults == ytest
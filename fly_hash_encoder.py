@@ -1,67 +1,450 @@
 import numpy as np
+import numba
+import json, os
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 4096 # rows encoded at once, bounds the size of intermediate score matrices
+
+def flat_rows(x):
+    # a batch of e.g. (28, 28) images viewed as (28*28) long rows, without copying
+    return x.reshape(x.shape[0], -1)
+
+@numba.njit(nogil = True, fastmath = True, cache = True)
+def _sparse_row(x_row, connections, row):
+    # row = x_row.dot(dense projection) computed only over the non zero inputs
+    row[:] = 0
+    for j in range(x_row.size):
+        v = x_row[j]
+        if v == 0:
+            continue
+        for k in connections[j]:
+            row[k] += v
+
+@numba.njit(nogil = True, fastmath = True, cache = True)
+def _sparse_scores(x, connections, scores):
+    """
+    scores[i] = x[i].dot(dense projection) computed only over the non zero inputs of x[i]
+    connections[j] lists the outputs connected to input j
+    """
+    for i in range(x.shape[0]):
+        _sparse_row(x[i], connections, scores[i])
+    return scores
+
+@numba.njit(nogil = True, cache = True)
+def _sift_down(values, index, pos, size):
+    # restores the min-heap property of values (and their index) below pos
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and values[child + 1] < values[child]:
+            child += 1
+        if values[pos] <= values[child]:
+            break
+        values[pos], values[child] = values[child], values[pos]
+        index[pos], index[child] = index[child], index[pos]
+        pos = child
+
+@numba.njit(nogil = True, cache = True)
+def _top_bits(row, sdr_len, sdr):
+    """
+    writes into sdr the sorted positions of the sdr_len highest values in row. 
+    A sdr_len sized min-heap keeps the winners so far, most values are rejected by a single compare
+    """
+    heap = row[:sdr_len].copy()
+    for k in range(sdr_len):
+        sdr[k] = k
+    for k in range(sdr_len // 2 - 1, -1, -1):
+        _sift_down(heap, sdr, k, sdr_len)
+    for k in range(sdr_len, row.size):
+        if row[k] > heap[0]:
+            heap[0] = row[k]
+            sdr[0] = k
+            _sift_down(heap, sdr, 0, sdr_len)
+    sdr.sort()
+
+@numba.njit(nogil = True, cache = True)
+def _dense_sdrs(scores, factors, sdrs):
+    for i in range(scores.shape[0]):
+        _top_bits(scores[i] / factors, sdrs.shape[1], sdrs[i])
+
+@numba.njit(nogil = True, cache = True)
+def _sparse_sdrs(x, connections, factors, sdrs):
+    # scores are computed row by row, no score matrix is ever materialized
+    row = np.empty(factors.size, dtype = np.float32)
+    for i in range(x.shape[0]):
+        _sparse_row(x[i], connections, row)
+        _top_bits(row / factors, sdrs.shape[1], sdrs[i])
+
+@numba.njit(nogil = True, cache = True)
+def _row_norm(x_row):
+    # scale normalizing the input row sum to 1, as load_mnist_data.normalize() does
+    total = 0.0
+    for v in x_row:
+        total += v
+    return 1.0 / total if total > 0 else 1.0
+
+@numba.njit(nogil = True, cache = True)
+def _hist_row(row, norm, scale, counts, sums):
+    # adds each output's (normalized) score in row to that output's histogram, returns the highest score
+    last = counts.shape[1] - 1
+    top = 0.0
+    for k in range(row.size):
+        v = row[k] * norm
+        b = min(max(int(v * scale), 0), last)
+        counts[k, b] += 1
+        sums[k, b] += v
+        top = max(top, v)
+    return top
+
+@numba.njit(nogil = True, cache = True)
+def _dense_hist(scores, x, scale, counts, sums):
+    top = 0.0
+    for i in range(scores.shape[0]):
+        top = max(top, _hist_row(scores[i], _row_norm(x[i]), scale, counts, sums))
+    return top
+
+@numba.njit(nogil = True, cache = True)
+def _sparse_hist(x, connections, scale, counts, sums):
+    row = np.empty(counts.shape[0], dtype = np.float32)
+    top = 0.0
+    for i in range(x.shape[0]):
+        _sparse_row(x[i], connections, row)
+        top = max(top, _hist_row(row, _row_norm(x[i]), scale, counts, sums))
+    return top
+
+@numba.njit(nogil = True, cache = True)
+def _max_score(scores, x):
+    top = 0.0
+    for i in range(scores.shape[0]):
+        top = max(top, scores[i].max() * _row_norm(x[i]))
+    return top
+
+@numba.njit(nogil = True, cache = True)
+def _top_sums(counts, sums, tops):
+    """
+    for each output sums its tops highest scores, walking its histogram down from the top bin. 
+    Only the bin where the tops boundary falls is approximated, by its mean score
+    """
+    out = np.zeros(counts.shape[0], dtype = np.float64)
+    for k in range(counts.shape[0]):
+        need = tops
+        for b in range(counts.shape[1] - 1, -1, -1):
+            c = counts[k, b]
+            if c == 0:
+                continue
+            if c >= need:
+                out[k] += sums[k, b] * need / c
+                break
+            out[k] += sums[k, b]
+            need -= c
+    return out
+
+class FactorEstimator:
+    """
+    Streaming estimate of FHEncoder factors. 
+    A factor is the sum of an output's top scores (top_fraction of all rows seen),
+    normalized by its mean over all outputs. 
+
+    Instead of holding and sorting all scores, each output keeps a histogram of counts 
+    and sums of its scores, so memory is (sdr_size, bins) regardless of the number of rows.
+    The histogram range is set to twice the highest score in the first update (its first
+    256 rows for sparse projections) and doubles, merging bin pairs, whenever a later update
+    sees higher scores. Scores above the range at the time go into the top bin, their sums stay exact. 
+
+    Scores are normalized by their input row sums, so raw (e.g. uint8) 
+    and normalized inputs yield the same factors. Inputs must not be negative.
+    """
+    def __init__(self, sdr_size, bins = 1024, top_fraction = 0.02):
+        self.counts = np.zeros((sdr_size, bins), dtype = np.uint32)
+        self.sums = np.zeros((sdr_size, bins), dtype = np.float64)
+        self.top_fraction = top_fraction
+        self.scale = None
+        self.rows = 0
+
+    def set_range(self, max_score):
+        """
+        sets the range on the first call, later calls double it until max_score fits
+        """
+        bins = self.counts.shape[1]
+        if self.scale is None:
+            # all zero scores so far, any range will do until a higher score shows up
+            self.scale = bins / (2 * max_score) if max_score > 0 else bins / 2.0
+            return
+        half = bins // 2
+        while max_score * self.scale >= bins:
+            self.counts[:, :half] = self.counts[:, 0:2 * half:2] + self.counts[:, 1:2 * half:2]
+            self.sums[:, :half] = self.sums[:, 0:2 * half:2] + self.sums[:, 1:2 * half:2]
+            self.counts[:, half:] = 0
+            self.sums[:, half:] = 0
+            self.scale /= 2
+
+    @staticmethod
+    def _check(x):
+        if x.size and x.min() < 0:
+            raise ValueError("factors can't be estimated from negative inputs")
+
+    def update(self, scores, x):
+        """
+        adds a (rows, sdr_size) score matrix computed from x 
+        """
+        self._check(x)
+        self.set_range(_max_score(scores, x))
+        _dense_hist(scores, x, self.scale, self.counts, self.sums)
+        self.rows += scores.shape[0]
+
+    def update_sparse(self, x, connections):
+        """
+        like update() but scores are computed row by row from a sparse projection
+        """
+        self._check(x)
+        if self.scale is None:
+            head = x[:256]
+            scores = np.empty((head.shape[0], self.counts.shape[0]), dtype = np.float32)
+            self.set_range(_max_score(_sparse_scores(head, connections, scores), head))
+        # scores seen only now widen the range for the next updates
+        self.set_range(_sparse_hist(x, connections, self.scale, self.counts, self.sums))
+        self.rows += x.shape[0]
+
+    def factors(self):
+        tops = max(1, int(self.rows * self.top_fraction))
+        sums = _top_sums(self.counts, self.sums, tops)
+        mean = sums.mean()
+        # nothing but zero scores seen, all outputs are alike
+        return sums / mean if mean > 0 else np.ones_like(sums)
+
 class FHEncoder():
 
-    def __init__(self, file_name = None, random_seed = 1, sdr_size=2048, spread=128): 
+    def __init__(self, file_name = None, random_seed = 1, sdr_size=2048, spread=128, sparse = False):
+        """
+        file_name: loads an encoder previously save()-d, other parameters are ignored
+
+        sparse: when True the random projection is stored as a list of spread connected outputs
+                for each input, and scores are computed only over non zero inputs.
+                It is much cheaper than the dense .dot() for sparse inputs like MNIST digits
+                Both modes produce the same projection for the same random_seed.
+        """
         if file_name is None: 
             self.sdr_size = sdr_size
             self.spread = spread
             self.random_seed = random_seed
+            self.sparse = sparse
             self.dot_encoders = None
+            self.connections = None
+            self.factors = None
+            self.estimator = None
         else:
             self.load(file_name)
 
     def generate_dot_encoders(self, input_size):
-        np.random.seed(self.random_seed)
-        dot_enc_shape = (input_size, self.sdr_size) 
-        dot_encoders = np.zeros(dot_enc_shape, dtype = np.float32)
-        dot_encoders[:,:self.spread] = 1
-        for line in dot_encoders:
-            np.random.shuffle(line)
-        # print(f"Generated self.dot_encoders of shape {dot_encoders.shape}")
-        self.dot_encoders = dot_encoders
-       
-    def compute_sdrs(self, x, sdr_len = 32): 
+        # each input connects to spread random outputs, picked from random keys in one vectorized step
+        rng = np.random.RandomState(self.random_seed)
+        keys = rng.random_sample((input_size, self.sdr_size)).astype(np.float32)
+        connections = np.argpartition(keys, self.spread - 1, axis = 1)[:, :self.spread]
+        connections.sort(axis = 1)
+        self.connections = connections.astype(np.uint32)
+        if self.sparse:
+            self.dot_encoders = None
+        else:
+            dot_encoders = np.zeros((input_size, self.sdr_size), dtype = np.float32)
+            np.put_along_axis(dot_encoders, connections, 1, axis = 1)
+            # print(f"Generated self.dot_encoders of shape {dot_encoders.shape}")
+            self.dot_encoders = dot_encoders
+
+    def scores(self, x):
+        """
+        projects each row of x into sdr_size output scores
+        """
+        x = flat_rows(x)
+        if self.sparse:
+            scores = np.empty((x.shape[0], self.sdr_size), dtype = np.float32)
+            return _sparse_scores(x, self.connections, scores)
         # Use .dot variant since gets faster as # of spread increases
-        if self.dot_encoders is None:
+        if x.dtype != np.float32:
+            x = x.astype(np.float32) # one chunk at a time, BLAS wants floats
+        return x.dot(self.dot_encoders)
+
+    def compute_sdrs(self, x, sdr_len = 32, chunk_size = CHUNK_SIZE):
+        """
+        encodes each row of x into a sdr_len long SDR. 
+        returns a (x.shape[0], sdr_len) array of sorted SDRs
+
+        x can be normalized float rows or raw data, e.g. a (n, 28, 28) uint8 batch of MNIST digits. 
+        Ranking the scores of a row does not depend on the row's scale, 
+        so rows are normalized only where it matters, when factors are computed.
+        """
+        sdrs = np.empty((x.shape[0], sdr_len), dtype = np.uint32)
+        for start, chunk in self.encode_iter(x, sdr_len, chunk_size):
+            sdrs[start:start + len(chunk)] = chunk
+        return sdrs
+
+    def encode_iter(self, x, sdr_len = 32, chunk_size = CHUNK_SIZE):
+        """
+        streaming compute_sdrs(), yields (start row, sdrs) for each chunk_size rows of x
+        Only one chunk of scores is held in memory, so x can be e.g. a memory mapped array.
+        On first use factors are fit from x in a first chunked pass, also one chunk at a time,
+        fit them beforehand with partial_fit() to encode in a single pass.
+        """
+        x = flat_rows(x)
+        self.prepare(x, chunk_size)
+        for start in range(0, x.shape[0], chunk_size):
+            yield start, self.encode_chunk(x[start:start + chunk_size], sdr_len)
+
+    def encode_parallel(self, x, sdr_len = 32, workers = None, chunk_size = CHUNK_SIZE, out = None):
+        """
+        like compute_sdrs() but chunks are encoded by a pool of workers threads. 
+        The compiled kernels (and BLAS for dense encoders) release the GIL so throughput 
+        scales with cores. Each chunk is written in place into out, a preallocated 
+        (x.shape[0], sdr_len) uint32 array which is allocated if not provided.
+        workers defaults to os.cpu_count(), chunks shrink below chunk_size so each worker gets one.
+        """
+        x = flat_rows(x)
+        self.prepare(x, chunk_size)
+        if out is None:
+            out = np.empty((x.shape[0], sdr_len), dtype = np.uint32)
+        assert out.shape == (x.shape[0], sdr_len) and out.dtype == np.uint32
+        workers = workers or os.cpu_count()
+        # smaller chunks when there are fewer than workers of them, so all workers get rows
+        chunk_size = max(1, min(chunk_size, -(-x.shape[0] // workers)))
+        def encode(start):
+            end = start + chunk_size
+            self.encode_chunk(x[start:end], sdr_len, out[start:end])
+        with ThreadPoolExecutor(workers) as pool:
+            # list() re-raises any worker exception here
+            list(pool.map(encode, range(0, x.shape[0], chunk_size)))
+        return out
+
+    def prepare(self, x, chunk_size = CHUNK_SIZE):
+        """
+        generates the projection and factors on first use, from x
+        """
+        x = flat_rows(x)
+        if self.connections is None:
             self.generate_dot_encoders(x.shape[1])
-            self.init_factors(x)
-        scores = x.dot(self.dot_encoders) 
-        sdrs = np.flip(np.argsort(scores / self.factors),axis = -1)
-        return sdrs[:,:sdr_len].astype(np.uint32)
-        
-    def init_factors(self,x): 
+        if self.factors is None:
+            self.init_factors(x, chunk_size)
+
+    def encode_chunk(self, x, sdr_len = 32, out = None):
+        """
+        encodes x in one step, its scores are held in memory unless the encoder is sparse.
+        """
+        x = flat_rows(x)
+        self._check_width(x)
+        if out is None:
+            out = np.empty((x.shape[0], sdr_len), dtype = np.uint32)
+        factors = self.factors.astype(np.float32)
+        if self.sparse:
+            _sparse_sdrs(x, self.connections, factors, out)
+        else:
+            _dense_sdrs(self.scores(x), factors, out)
+        return out
+
+    def init_factors(self, x, chunk_size = CHUNK_SIZE):
+        """
+        computes factors from x then freezes them. 
+        Factors scale each output by the sum of its top 2% scores, so all outputs are equally likely to win
+        This is what compute_sdrs() does with its first input unless factors are fit beforehand. 
+        """
         # This attempt to "skip" factors leads to a huge drop in accuracy from 94% to 90%
-        tops = x.shape[0] // 50
-        dotscores = x.dot(self.dot_encoders).T
-        dotscores.sort(axis=1)
-        dotscores = dotscores[:,-tops:].sum(axis=1)
-        self.factors = dotscores / dotscores.mean()
-
-    def load(self,fname):
-        if fname.split('.')[-1] != "npz": 
-            fname += ".npz"
-        data = np.load(fname)
-        self.encodings = data["encodings"]
-        self.factors = data["factors"]
+        self.reset_factors()
+        self.partial_fit(x, chunk_size)
+        self.freeze()
+
+    def reset_factors(self, bins = 1024):
+        """
+        starts (re)fitting factors from scratch, feed data with partial_fit()
+        """
+        self.factors = None
+        self.estimator = FactorEstimator(self.sdr_size, bins)
+
+    def partial_fit(self, x, chunk_size = CHUNK_SIZE):
+        """
+        updates factors with more rows, in chunks. Memory use does not depend on how many rows are seen
+        """
+        x = flat_rows(x)
+        if self.connections is None:
+            self.generate_dot_encoders(x.shape[1])
+        self._check_width(x)
+        if self.estimator is None:
+            assert self.factors is None, "factors are frozen, reset_factors() to refit them"
+            self.reset_factors()
+        for start in range(0, x.shape[0], chunk_size):
+            chunk = x[start:start + chunk_size]
+            if self.sparse:
+                self.estimator.update_sparse(chunk, self.connections)
+            else:
+                self.estimator.update(self.scores(chunk), chunk)
+        self.factors = self.estimator.factors()
+
+    def _check_width(self, x):
+        # the kernels don't bounds check, a wrong width would read past connections
+        if x.shape[1] != self.connections.shape[0]:
+            raise ValueError(f"rows have {x.shape[1]} inputs, the encoder was built for {self.connections.shape[0]}")
+
+    def freeze(self):
+        """
+        keeps current factors and releases the estimator's memory
+        """
+        self.estimator = None
+
+    def load(self, fname, mmap_mode = 'r'):
+        """
+        loads an encoder saved with save(). 
+        The projection and factors are memory mapped (unless mmap_mode is None) so loading 
+        takes milliseconds and worker processes share the same pages. 
+        A loaded encoder computes exactly the same SDRs as the saved one
+        """
+        with open(os.path.join(fname, "config.json")) as f:
+            config = json.load(f)
+        self.sdr_size = config["sdr_size"]
+        self.spread = config["spread"]
+        self.random_seed = config["random_seed"]
+        self.sparse = config["sparse"]
+        self.connections = np.load(os.path.join(fname, "connections.npy"), mmap_mode = mmap_mode)
+        self.factors = np.load(os.path.join(fname, "factors.npy"), mmap_mode = mmap_mode)
+        self.dot_encoders = None
+        self.estimator = None
+        if not self.sparse:
+            self.dot_encoders = np.load(os.path.join(fname, "dot_encoders.npy"), mmap_mode = mmap_mode)
 
     def save(self, fname):
-        np.savez(fname, encodings = self.encodings, factors = self.factors) 
+        """
+        saves the encoder in the fname directory: a config.json and .npy files 
+        for the projection (connections, plus dot_encoders for dense encoders) and factors.
+        The encoder must have been used (or its factors initialised) before saving.
+        """
+        assert self.connections is not None and self.factors is not None
+        os.makedirs(fname, exist_ok = True)
+        config = dict(sdr_size = self.sdr_size, spread = self.spread, 
+                      random_seed = self.random_seed, sparse = self.sparse)
+        with open(os.path.join(fname, "config.json"), "w") as f:
+            json.dump(config, f, indent = 4)
+        np.save(os.path.join(fname, "connections.npy"), self.connections)
+        np.save(os.path.join(fname, "factors.npy"), self.factors)
+        if not self.sparse:
+            np.save(os.path.join(fname, "dot_encoders.npy"), self.dot_encoders)
 
 if __name__ == "__main__":
-    from load_mnist_data import x_train,normalize
+    from load_mnist_data import x_train
     from time import time
 
-    X = normalize(x_train)
+    X = x_train # raw uint8 digits
     SDR_SIZE = 2048
 
-    fhe = FHEncoder(sdr_size=SDR_SIZE)
-    
-
     num = 10000
 
-    t = time()
-    sdrs = fhe.compute_sdrs(X[:num])
-    t = time() - t
-    print(f"{num} sdrs of shape {sdrs.shape} computed in {int(t*1000)}ms")
+    for sparse in (False, True):
+        fhe = FHEncoder(sdr_size=SDR_SIZE, sparse = sparse)
+        fhe.compute_sdrs(X[:num]) # generate projection, init factors and compile
+
+        t = time()
+        sdrs = fhe.compute_sdrs(X[:num])
+        t = time() - t
+        print(f"{num} sdrs of shape {sdrs.shape} computed in {int(t*1000)}ms, sparse = {sparse}")
+
+        t = time()
+        psdrs = fhe.encode_parallel(X[:num])
+        t = time() - t
+        print(f"{num} sdrs computed by {os.cpu_count()} workers in {int(t*1000)}ms, same: {(psdrs == sdrs).all()}")
 
     # print(fhe.factors)
@@ -1,24 +1,80 @@
+"""
+Lazy MNIST loader.
+
+x_test, y_test, x_train, y_train are loaded only when first accessed, e.g.
+    from load_mnist_data import x_test
+touches only the test digits.
+
+On first use mnist_data.npz is unpacked once into uncompressed .npy files (in mnist_npy/)
+which are then memory mapped, so startup is near instant and worker processes share the same pages.
+load(name, normalized = True) does the same with a cached float32 normalize()-d copy.
+"""
 import numpy as np
 import os
 
-dname = os.path.dirname(__file__) 
+dname = os.path.dirname(__file__)
 if len(dname) == 0:
     dname = '.'
 
-_d = np.load(dname + "/mnist_data.npz") 
-x_test,  y_test  = _d['x_test'], _d['y_test']
-x_train, y_train = _d['x_train'],_d['y_train']
+NAMES = ('x_test', 'y_test', 'x_train', 'y_train')
+NPZ_FILE  = dname + "/mnist_data.npz"
+CACHE_DIR = dname + "/mnist_npy"
+
+_loaded = {}
 
 def normalize(X):
     """
-    transforms X so sum() of each digit is 1. 
+    transforms X so sum() of each digit is 1.
     X must be adimensional, e.g. for MNIST each digit of shape (28,28) should be reshaped to (784,)
     """
     X = X.reshape(X.shape[0],-1)
     sums = X.sum(axis=1)
     return (X.T / sums).T.astype(np.float32)
 
+def _save(fname, data):
+    # writes to a temporary file first so concurrent processes never map a partial file
+    tmp = f"{fname}.{os.getpid()}.tmp.npy"
+    np.save(tmp, data)
+    os.replace(tmp, fname)
+
+def _unpack():
+    os.makedirs(CACHE_DIR, exist_ok = True)
+    with np.load(NPZ_FILE) as npz:
+        for name in NAMES:
+            fname = f"{CACHE_DIR}/{name}.npy"
+            if not os.path.exists(fname):
+                _save(fname, npz[name])
+
+def load(name, normalized = False, mmap_mode = 'r'):
+    """
+    returns one of x_test, y_test, x_train, y_train as a memory mapped array
+    normalized: returns normalize()-d float32 digits, computed once then cached as well
+    """
+    assert name in NAMES
+    key = (name, normalized, mmap_mode)
+    if key not in _loaded:
+        fname = f"{CACHE_DIR}/{name}.npy"
+        if not os.path.exists(fname):
+            _unpack()
+        if normalized:
+            nname = f"{CACHE_DIR}/{name}_norm.npy"
+            if not os.path.exists(nname):
+                _save(nname, normalize(np.load(fname, mmap_mode = 'r')))
+            fname = nname
+        _loaded[key] = np.load(fname, mmap_mode = mmap_mode)
+    return _loaded[key]
+
+def __getattr__(name):
+    # module level x_test, y_test, x_train, y_train are loaded on first access
+    if name in NAMES:
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
+    from time import time
     # np.savez("mnist_data", x_test = x_test, x_train = x_train, y_test = y_test, y_train = y_train)
-    print(f"mnist data loaded in {[k[0] for k in _d.items()]}")
-    print({normalize(x_test).sum()})
+    t = time()
+    data = {name: load(name) for name in NAMES}
+    t = time() - t
+    print(f"mnist data loaded in {[(k, v.shape) for k, v in data.items()]} in {int(t*1000)}ms")
+    print({normalize(data['x_test']).sum()})
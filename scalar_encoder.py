@@ -0,0 +1,104 @@
+"""
+Batched scalar / vector to SDR encoder
+
+Each of the features of a vector gets its own segment of the SDR, where a block of
+consecutive ON bits slides from the segment's start to its end as the feature's value
+goes from its min to its max. It is the encoding cartpole_play.py used for its state.
+
+    enc = ScalarEncoder(features = 4, sdr_size = 100, bits = 4)
+    sdrs = enc.encode(x, adapt = True)  # x is (n, 4), sdrs is (n, 16) uint32, sorted
+
+Layout (segment starts, widths, bits) is computed once, ranges are either fixed,
+fit() to data, or adapted in bulk, widening to the min/max of each encoded batch.
+Encoding is a compiled loop writing into a preallocated output, with values
+outside the range clipped to the segment's ends.
+"""
+import numpy as np
+import numba
+
+@numba.njit(nogil = True, cache = True)
+def _encode(x, minims, maxims, starts, widths, bits, out):
+    for n in range(x.shape[0]):
+        pos = 0
+        for i in range(x.shape[1]):
+            rang = maxims[i] - minims[i]
+            w = 0
+            if rang > 0:
+                w = int(widths[i] * (x[n, i] - minims[i]) / rang)
+                w = min(max(w, 0), widths[i])
+            for k in range(bits[i]):
+                out[n, pos] = starts[i] + w + k
+                pos += 1
+    return out
+
+class ScalarEncoder:
+    def __init__(self, features, sdr_size, bits, minims = None, maxims = None):
+        """
+        features: number of scalars in each input vector
+        sdr_size: total SDR size, split in equal segments, one for each feature
+        bits: ON bits for each feature, a number or one for each feature
+        minims, maxims: initial ranges, a number or one for each feature.
+            Without them ranges start empty and must be fit() or adapted while encoding
+        """
+        self.features = features
+        self.sdr_size = sdr_size
+        self.bits = np.broadcast_to(np.asarray(bits, dtype = np.int64), (features,)).copy()
+        segment = sdr_size // features
+        assert (self.bits < segment).all(), "too many bits for the segment size"
+        self.starts = np.arange(features, dtype = np.int64) * segment
+        self.widths = segment - self.bits
+        self.sdr_len = int(self.bits.sum())
+
+        self.minims = np.full(features, np.inf)
+        self.maxims = np.full(features, -np.inf)
+        if minims is not None:
+            self.minims[:] = minims
+        if maxims is not None:
+            self.maxims[:] = maxims
+
+    def adapt(self, x):
+        """
+        widens the ranges to include all rows of x
+        """
+        x = np.asarray(x).reshape(-1, self.features)
+        np.minimum(self.minims, x.min(axis = 0), out = self.minims)
+        np.maximum(self.maxims, x.max(axis = 0), out = self.maxims)
+
+    def fit(self, x):
+        """
+        sets the ranges to the min/max of x
+        """
+        self.minims[:], self.maxims[:] = np.inf, -np.inf
+        self.adapt(x)
+        return self
+
+    def encode(self, x, adapt = False, out = None):
+        """
+        encodes a (n, features) array into a (n, sdr_len) uint32 array of sorted SDRs.
+        adapt: widen ranges to x first
+        out: optional preallocated output, reused without allocations
+        """
+        x = np.asarray(x).reshape(-1, self.features)
+        if adapt:
+            self.adapt(x)
+        if out is None:
+            out = np.empty((x.shape[0], self.sdr_len), dtype = np.uint32)
+        return _encode(x, self.minims, self.maxims, self.starts, self.widths, self.bits, out)
+
+    def encode_one(self, vector, adapt = False):
+        """
+        encodes a single vector into a 1d SDR
+        """
+        return self.encode(vector, adapt)[0]
+
+if __name__ == "__main__":
+    from time import time
+    N, FEATURES = 1_000_000, 8
+    enc = ScalarEncoder(FEATURES, sdr_size = 1024, bits = 6)
+    x = np.random.normal(size = (N, FEATURES))
+    out = np.empty((N, enc.sdr_len), dtype = np.uint32)
+    enc.encode(x[:10], adapt = True, out = out[:10])   # give numba time to compile
+    t = time()
+    enc.encode(x, adapt = True, out = out)
+    t = time() - t
+    print(f"{N} vectors of {FEATURES} features encoded in {int(t*1000)}ms, sdr: {out[0]}")
@@ -0,0 +1,250 @@
+"""
+Cross-backend associative memory benchmark
+
+Runs the same generated workloads against SDRMap, SDR_MEM, DiadicMemory and TriadicMemory:
+    - items random keys (and values) are stored
+    - every query is a key with noise bits switched by near_sdr_batch(), then truncated
+      to query_bits ON bits (query truncation), timed one by one for latency percentiles
+
+A query is a hit when:
+    - SDRMap, SDR_MEM: the best id returned is the stored item's id
+    - DiadicMemory, TriadicMemory: the returned SDR overlaps at least 90% of the stored value
+
+Workloads are the product of the --items, --on-bits, --noise, --query-bits lists.
+Backends which would need more than --max-mbytes are skipped for that workload.
+
+    $ python3 sdr_bench.py
+    $ python3 sdr_bench.py --items 1000 10000 --noise 0 2 4 --backends sdrmap sdrmem --csv out.csv
+    $ python3 sdr_bench.py --sdr-size 500 --backends triadic --json out.json
+
+"""
+import numpy as np
+import abc, argparse, itertools, csv, json
+from time import perf_counter, perf_counter_ns
+
+from sdr_util import random_sdr_batch, near_sdr_batch, sdr_overlap
+
+class Backend(abc.ABC):
+    """
+    Common front end, subclasses wrap each memory
+    """
+    name = None
+
+    def __init__(self, sdr_size, on_bits, args):
+        self.sdr_size, self.on_bits = sdr_size, on_bits
+
+    @staticmethod
+    @abc.abstractmethod
+    def nbytes_needed(sdr_size, on_bits, args):
+        pass
+
+    def nbytes(self):
+        return self.mem.nbytes
+
+    @abc.abstractmethod
+    def store_all(self, ids, keys, values):
+        pass
+
+    @abc.abstractmethod
+    def hit(self, query, ids, keys, values, i):
+        """
+        queries, returns True if item i was recalled
+        """
+
+class SDRMapBackend(Backend):
+    name = "sdrmap"
+
+    def __init__(self, sdr_size, on_bits, args):
+        from sdr_mem2d import SDRMap
+        super().__init__(sdr_size, on_bits, args)
+        self.smap = SDRMap(sdr_size = sdr_size, slot_size = args.slot_size)
+        self.smap.MAP[:] = 0     # MAP is np.empty, stale memory would skew recall between runs
+        self.mem = self.smap.MAP
+
+    @staticmethod
+    def nbytes_needed(sdr_size, on_bits, args):
+        return sdr_size * (sdr_size - 1) // 2 * args.slot_size * 4
+
+    def store_all(self, ids, keys, values):
+        self.smap.store(ids, keys)
+
+    def hit(self, query, ids, keys, values, i):
+        found, _ = self.smap.query([query], first = 1)
+        return len(found[0]) > 0 and found[0][0] == ids[i]
+
+class SDRMemBackend(Backend):
+    name = "sdrmem"
+
+    def __init__(self, sdr_size, on_bits, args):
+        from sdr_id_mem import SDR_MEM
+        super().__init__(sdr_size, on_bits, args)
+        self.sdr_mem = SDR_MEM(args.mem_mbytes * 2**20, slot_size = args.slot_size)
+        self.mem = self.sdr_mem.mem
+        self.thresh = args.thresh
+
+    @staticmethod
+    def nbytes_needed(sdr_size, on_bits, args):
+        return args.mem_mbytes * 2**20
+
+    def store_all(self, ids, keys, values):
+        self.sdr_mem.store_many(keys, ids)
+
+    def hit(self, query, ids, keys, values, i):
+        found = self.sdr_mem.query(query, self.thresh)
+        return len(found) > 0 and found[0][1] == ids[i]
+
+class DiadicBackend(Backend):
+    name = "diadic"
+
+    def __init__(self, sdr_size, on_bits, args):
+        from sdrsdm import DiadicMemory
+        super().__init__(sdr_size, on_bits, args)
+        self.sdm = DiadicMemory(sdr_size, on_bits)
+        self.mem = self.sdm.mem
+
+    @staticmethod
+    def nbytes_needed(sdr_size, on_bits, args):
+        return sdr_size * (sdr_size - 1) // 2 * sdr_size
+
+    def store_all(self, ids, keys, values):
+        for x, y in zip(keys, values):
+            self.sdm.store(x, y)
+
+    def hit(self, query, ids, keys, values, i):
+        return sdr_overlap(self.sdm.query(query).astype(np.uint32), values[i]) >= 0.9 * self.on_bits
+
+class TriadicBackend(Backend):
+    """
+    stores (key, ids SDR, value) triples, queries the value from a noisy key and the exact second SDR
+    """
+    name = "triadic"
+
+    def __init__(self, sdr_size, on_bits, args):
+        from sdrsdm import TriadicMemory
+        super().__init__(sdr_size, on_bits, args)
+        self.tm = TriadicMemory(sdr_size, on_bits)
+        self.mem = self.tm.mem
+
+    @staticmethod
+    def nbytes_needed(sdr_size, on_bits, args):
+        return sdr_size ** 3
+
+    def store_all(self, ids, keys, values):
+        # second member of the triple is the value rolled by one item, independent from key and value
+        for x, y, z in zip(keys, np.roll(values, 1, axis = 0), values):
+            self.tm.store(x, y, z)
+
+    def hit(self, query, ids, keys, values, i):
+        y = values[i - 1]
+        return sdr_overlap(self.tm.query(query, y).astype(np.uint32), values[i]) >= 0.9 * self.on_bits
+
+BACKENDS = {b.name: b for b in (SDRMapBackend, SDRMemBackend, DiadicBackend, TriadicBackend)}
+
+def _truncate(queries, query_bits, seed):
+    # keeps a random, still sorted, subset of query_bits ON bits in each query
+    if query_bits >= queries.shape[1]:
+        return queries
+    rng = np.random.RandomState(seed)
+    keep = np.argsort(rng.random(queries.shape), axis = 1)[:, :query_bits]
+    return np.sort(np.take_along_axis(queries, keep, axis = 1), axis = 1)
+
+def workload(items, sdr_size, on_bits, noise, query_bits, queries, seed = 1):
+    """
+    generates ids, keys, values and (noisy, truncated) queries for a workload
+    """
+    ids = np.arange(1, items + 1, dtype = np.uint32)
+    keys = random_sdr_batch(items, sdr_size, on_bits, seed = seed)
+    values = random_sdr_batch(items, sdr_size, on_bits, seed = seed + 1)
+    which = np.random.RandomState(seed).choice(items, size = min(queries, items), replace = False)
+    qsdrs = near_sdr_batch(keys[which], sdr_size, noise, seed = seed + 2) if noise else keys[which].copy()
+    return ids, keys, values, which, _truncate(qsdrs, query_bits, seed + 3)
+
+def warmup(backend_class, on_bits, args):
+    # compiles numba kernels on a tiny memory so it does not count in timings
+    small = argparse.Namespace(**{**vars(args), "mem_mbytes": 1})
+    ids, keys, values, which, queries = workload(4, 64, min(on_bits, 8), 0, 8, 2)
+    b = backend_class(64, min(on_bits, 8), small)
+    b.store_all(ids, keys, values)
+    b.hit(queries[0], ids, keys, values, which[0])
+
+def bench(backend_class, items, sdr_size, on_bits, noise, query_bits, args):
+    """
+    runs one workload on one backend, returns a result dict
+    """
+    ids, keys, values, which, queries = workload(items, sdr_size, on_bits, noise, query_bits, args.queries, args.seed)
+    backend = backend_class(sdr_size, on_bits, args)
+
+    t = perf_counter()
+    backend.store_all(ids, keys, values)
+    t_store = perf_counter() - t
+
+    latencies = np.empty(len(queries), dtype = np.int64)
+    hits = 0
+    for n, (q, i) in enumerate(zip(queries, which)):
+        t = perf_counter_ns()
+        hits += bool(backend.hit(q, ids, keys, values, i))
+        latencies[n] = perf_counter_ns() - t
+
+    p50, p90, p99 = np.percentile(latencies, (50, 90, 99)) / 1000
+    return dict(backend = backend.name, items = items, sdr_size = sdr_size, on_bits = on_bits,
+                noise = noise, query_bits = query_bits,
+                insert_per_sec = items / max(t_store, 1e-9),
+                query_per_sec = len(queries) / max(latencies.sum() / 1e9, 1e-9),
+                p50_us = p50, p90_us = p90, p99_us = p99,
+                bytes_per_item = backend.nbytes() / items,
+                recall = hits / len(queries))
+
+def run(args):
+    results = []
+    for name in args.backends:
+        backend_class = BACKENDS[name]
+        warmed = False
+        for items, on_bits, noise, query_bits in itertools.product(args.items, args.on_bits, args.noise, args.query_bits):
+            if backend_class.nbytes_needed(args.sdr_size, on_bits, args) > args.max_mbytes * 2**20:
+                print(f"{name:>8} items {items} bits {on_bits} noise {noise} qbits {min(query_bits, on_bits)}: skipped, "
+                      f"needs more than {args.max_mbytes}MB for sdr_size {args.sdr_size}")
+                continue
+            if not warmed:
+                warmup(backend_class, on_bits, args)
+                warmed = True
+            res = bench(backend_class, items, args.sdr_size, on_bits, noise, min(query_bits, on_bits), args)
+            results.append(res)
+            print(f"{name:>8} items {items} bits {on_bits} noise {noise} qbits {res['query_bits']}: "
+                  f"{int(res['insert_per_sec'])} ins/s, {int(res['query_per_sec'])} q/s, "
+                  f"p50/p99 {res['p50_us']:.0f}/{res['p99_us']:.0f}us, "
+                  f"{res['bytes_per_item']:.0f} bytes/item, recall {res['recall']:.3f}")
+    return results
+
+def parser():
+    p = argparse.ArgumentParser(description = __doc__.split("\n\n")[0].strip())
+    p.add_argument("--backends", nargs = "+", choices = sorted(BACKENDS), default = list(BACKENDS))
+    p.add_argument("--sdr-size", type = int, default = 1000)
+    p.add_argument("--items", type = int, nargs = "+", default = [1000, 10000])
+    p.add_argument("--on-bits", type = int, nargs = "+", default = [10, 20])
+    p.add_argument("--noise", type = int, nargs = "+", default = [0, 2], help = "bits switched in queries")
+    p.add_argument("--query-bits", type = int, nargs = "+", default = [1000],
+                   help = "ON bits kept in queries, capped to on-bits")
+    p.add_argument("--queries", type = int, default = 1000)
+    p.add_argument("--seed", type = int, default = 1)
+    p.add_argument("--slot-size", type = int, default = 32, help = "sdrmap, sdrmem slot size")
+    p.add_argument("--mem-mbytes", type = int, default = 64, help = "sdrmem size")
+    p.add_argument("--thresh", type = int, default = 5, help = "sdrmem minimum pair hits")
+    p.add_argument("--max-mbytes", type = int, default = 2048, help = "skip backends needing more memory")
+    p.add_argument("--json", help = "write results to this .json file")
+    p.add_argument("--csv", help = "write results to this .csv file")
+    return p
+
+if __name__ == "__main__":
+    p = parser()
+    args = p.parse_args()
+    if min(args.query_bits) < 2 or min(args.on_bits) < 2:
+        p.error("all memories index bit pairs, --on-bits and --query-bits must be at least 2")
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(params = vars(args), results = results), f, indent = 2)
+    if args.csv and results:
+        with open(args.csv, "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
@@ -0,0 +1,178 @@
+"""
+LRU cache of query results, for loops where the same state SDRs recur
+
+    mem = cached(SDR_MEM(mem_size), maxsize = 4096)
+    mem.store(sdr, sid)          # everything else is forwarded to the wrapped memory
+    ids = mem.query(sdr)         # computed once, then a dict probe until the memory changes
+
+Works with SDRMap (query, per row of the batch), SDR_MEM.query, DiadicMemory.query,
+TriadicMemory.query and ValueCorrMap.score. ValueCorrMap.query returns a one shot generator,
+so it is forwarded uncached.
+
+The key is the SDRs exactly as given (dtype, shape and bytes) plus the other query arguments
+as plain values. Bit order is part of the key since pair addressed memories can answer
+differently for a reordered SDR, so there are no false hits. A probe costs a few microseconds, so it pays
+off for queries costing more than that, e.g. SDR_MEM or DiadicMemory, less so for a
+ValueCorrMap.score() of a short SDR.
+Each memory counts its writes (store, add, tick), the cache is dropped as soon as that
+count differs from the one its entries were computed at, whether the write went through
+the wrapper or to the memory directly.
+
+Results are shared between hits, don't modify them in place.
+stats() returns hits, misses, evictions, invalidations and hit_rate, with SDR_METRICS set
+they are also counted as cache.<name>.* metrics.
+"""
+from collections import OrderedDict
+import numpy as np
+import sdr_metrics as metrics
+from sdr_mem2d import SDRMap
+from sdr_value_map import ValueCorrMap
+
+_METRICS = metrics.ENABLED   # probes are compiled out unless SDR_METRICS is set
+
+def sdr_key(sdr):
+    """
+    hashable, exact key of a sparse SDR as given
+    """
+    sdr = np.ascontiguousarray(sdr)
+    return sdr.dtype.str, sdr.shape, sdr.tobytes()
+
+def _arg_key(arg):
+    # SDRs by content, None (Triadic's queried member) and scalars like thresh as they are
+    if arg is None or np.ndim(arg) == 0:
+        return arg
+    return sdr_key(arg)
+
+_MISS = object()    # get() result for a missing key, None is a valid result, e.g. of TriadicMemory.query
+
+class QueryCache:
+    def __init__(self, maxsize = 4096, name = "query"):
+        self.maxsize = maxsize
+        self.name = name
+        self.entries = OrderedDict()
+        self.writes = None          # memory's write count the entries were computed at
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def validate(self, writes):
+        """
+        drops all entries if the memory was written since they were computed
+        """
+        if writes != self.writes:
+            if self.entries:
+                self.entries.clear()
+                self.invalidations += 1
+                if _METRICS: metrics.count(f"cache.{self.name}.invalidations")
+            self.writes = writes
+
+    def get(self, key):
+        """
+        cached result or _MISS
+        """
+        value = self.entries.get(key, _MISS)
+        if value is _MISS:
+            self.misses += 1
+            if _METRICS: metrics.count(f"cache.{self.name}.misses")
+            return _MISS
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if _METRICS: metrics.count(f"cache.{self.name}.hits")
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+            if _METRICS: metrics.count(f"cache.{self.name}.evictions")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(size = len(self.entries), maxsize = self.maxsize, hits = self.hits, misses = self.misses,
+                    evictions = self.evictions, invalidations = self.invalidations,
+                    hit_rate = self.hits / lookups if lookups else 0.0)
+
+class CachedMemory:
+    """
+    wraps a memory, caching query() / score() results, forwarding all other attributes
+    """
+    def __init__(self, memory, maxsize = 4096, name = None):
+        self.memory = memory
+        self.cache = QueryCache(maxsize, name or type(memory).__name__.lower())
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    def query(self, *args, **kwargs):
+        if isinstance(self.memory, SDRMap):
+            return self._query_rows(*args, **kwargs)
+        if isinstance(self.memory, ValueCorrMap):
+            return self.memory.query(*args, **kwargs)
+        key = tuple(_arg_key(arg) for arg in args)
+        if kwargs:
+            key += tuple((name, _arg_key(arg)) for name, arg in sorted(kwargs.items()))
+        self.cache.validate(self.memory.writes)
+        found = self.cache.get(key)
+        if found is _MISS:
+            found = self.memory.query(*args, **kwargs)
+            self.cache.put(key, found)
+        return found
+
+    def score(self, sdr):
+        key = sdr_key(sdr)
+        self.cache.validate(self.memory.writes)
+        found = self.cache.get(key)
+        if found is _MISS:
+            found = self.memory.score(sdr)
+            self.cache.put(key, found)
+        return found
+
+    def _query_rows(self, sdrs, first = 4):
+        # SDRMap queries a batch, rows missing from the cache are queried together in one call
+        self.cache.validate(self.memory.writes)
+        keys = [(sdr_key(sdr), first) for sdr in sdrs]
+        found = [self.cache.get(key) for key in keys]
+        missing = [i for i, f in enumerate(found) if f is _MISS]
+        if missing:
+            ids, counts = self.memory.query([np.array(sdrs[i]) for i in missing], first)
+            for i, id_list, count_list in zip(missing, ids, counts):
+                found[i] = (id_list, count_list)
+                self.cache.put(keys[i], found[i])
+        return [f[0] for f in found], [f[1] for f in found]
+
+    def stats(self):
+        return self.cache.stats()
+
+def cached(memory, maxsize = 4096, name = None):
+    return CachedMemory(memory, maxsize, name)
+
+if __name__ == "__main__":
+    from time import time
+    from sdr_id_mem import SDR_MEM, random_sdrs
+    from sdrsdm import DiadicMemory
+    from sdr_value_map import ValueCorrMap
+
+    # a control loop revisiting 1000 distinct states, 100k lookups
+    STATES, LOOKUPS = 1000, 100_000
+    sdrs = random_sdrs(STATES, 1000, 10)
+    visits = np.random.zipf(1.5, size = LOOKUPS) % STATES
+
+    mem = SDR_MEM(50_000_000)
+    mem.store_many(sdrs, np.arange(STATES) + 1)
+    diadic = DiadicMemory(1000, 10)
+    for x, y in zip(sdrs, sdrs[::-1]):
+        diadic.store(x, y)
+    vmap = ValueCorrMap(sdr_size = 1000)
+    vmap.add_many(sdrs[:100])
+
+    for name, memory, method in (("sdr_mem", mem, "query"), ("diadic", diadic, "query"), ("valuemap", vmap, "score")):
+        cmem = cached(memory, maxsize = 256)
+        for m in (memory, cmem):
+            getattr(m, method)(sdrs[0])    # give numba time to compile
+        for label, m in (("plain ", memory), ("cached", cmem)):
+            run = getattr(m, method)
+            t = time()
+            for v in visits:
+                run(sdrs[v])
+            t = time() - t
+            print(f"{name:>9} {label} {LOOKUPS} {method}() in {int(t*1000)}ms")
+        print(f"{name:>9} cache {cmem.stats()}")
@@ -0,0 +1,218 @@
+"""
+Capacity planner for the pair-based memories, SDRMap (sdr_mem2d.py) and SDR_MEM (sdr_id_mem.py)
+
+Both store an item's id in one slot per ON bit pair, at a (pseudo)random position in the slot.
+An id is lost from a slot position when a later item writes there too, and a query finds
+the right id when enough of its pairs still hold it, more than any other id.
+
+Analytic model, for random SDRs with L ON bits in N bits and A addressable slots of slot_size S:
+    P    = L*(L-1)/2 pairs written by each item, A = N*(N-1)/2 for SDRMap,
+           min(num_slots, N*(N-1)/2) for SDR_MEM since its pair addresses wrap around num_slots
+    load = items * P / A                 writes per slot
+    x    = load / S                      later writes hitting one slot position
+    an id stored at fraction u of all items survives with chance exp(-x * (1 - u)),
+    on average p = (1 - exp(-x)) / x
+    hits of the right id   ~ Binomial(Q, exp(-x * (1 - u))), Q = matching pairs in the query
+    hits of any other id   ~ Poisson(Qall * P / A * p), Qall = all query pairs
+    recall = P(right hits pass the memory's threshold and beat items - 1 other ids), averaged over u
+
+It does not know about correlated data (e.g. fly hashes of similar digits collide much more),
+so simulate() checks a recommendation by storing and querying random SDRs in the real memory,
+scaled down to sim_items at the same load when the full size is too large.
+
+    $ python3 sdr_capacity.py --budget-mbytes 1024 --items 1000000 --on-bits 24 --target-recall 0.95
+    $ python3 sdr_capacity.py --budget-mbytes 256 --items 200000 --on-bits 20 --sdr-size 2048 --noise 2
+
+"""
+import numpy as np
+from math import lgamma, log, exp
+
+# threshold of ids' pair hits below which each memory's query drops them
+SDRMAP_MIN_HITS = 5     # SDRMap.query_extended(min_counts = 4) keeps counts > 4
+SDRMEM_THRESH = 5       # SDR_MEM.query(thresh = 5) default
+
+def pair_count(bits):
+    return bits * (bits - 1) // 2
+
+def sdrmem_min_hits(thresh = SDRMEM_THRESH):
+    # _bit_query() skips an id's first hit and starts counting from 0 at its second one
+    return thresh + 3
+
+def _binom_pmf(n, p):
+    k = np.arange(n + 1)
+    if p <= 0:
+        return (k == 0).astype(np.float64)
+    if p >= 1:
+        return (k == n).astype(np.float64)
+    logs = [lgamma(n + 1) - lgamma(i + 1) - lgamma(n - i + 1) + i * log(p) + (n - i) * log(1 - p) for i in k]
+    return np.exp(logs)
+
+def _poisson_cdf(mu, kmax):
+    # P(X <= k) for k in 0..kmax
+    pmf = np.empty(kmax + 1)
+    pmf[0] = exp(-mu)
+    for k in range(1, kmax + 1):
+        pmf[k] = pmf[k - 1] * mu / k
+    return np.minimum(np.cumsum(pmf), 1.0)
+
+def survival(items, pairs, slots, slot_size):
+    """
+    average chance an id written in a slot is still there after all items are stored
+    """
+    x = items * pairs / slots / slot_size
+    return 1.0 if x == 0 else (1 - exp(-x)) / x
+
+def recall_model(items, slots, slot_size, on_bits, query_bits = None, noise = 0, min_hits = SDRMAP_MIN_HITS, steps = 64):
+    """
+    expected chance a query returns the right id as best match, see module doc.
+    slots: addressable slots (pairs space for SDRMap)
+    query_bits: ON bits used in queries, default on_bits
+    noise: query bits switched from the stored SDR (as in near_sdr)
+    steps: recall is averaged over this many insertion positions, since early items lose more ids
+    """
+    query_bits = on_bits if query_bits is None else min(query_bits, on_bits)
+    pairs = pair_count(on_bits)
+    x = items * pairs / slots / slot_size
+    matching = int(query_bits * (on_bits - noise) / on_bits)
+    qpairs = pair_count(matching)
+    mu = pair_count(query_bits) * pairs / slots * survival(items, pairs, slots, slot_size)
+    # all (items - 1) other ids must score less than the right one
+    others = _poisson_cdf(mu, qpairs + 1) ** max(items - 1, 0)
+    k = np.arange(qpairs + 1)
+    beats = np.concatenate([[0.0], others[:-2]])   # P(max other hits <= k - 1)
+    recall = 0.0
+    for u in (np.arange(steps) + 0.5) / steps:
+        # an id written at fraction u of the items survives the later (1 - u) writes to its position
+        right = _binom_pmf(qpairs, exp(-x * (1 - u)))
+        recall += (right * beats * (k >= min_hits)).sum()
+    return float(recall / steps)
+
+def query_cost(on_bits, slot_size, query_bits = None):
+    """
+    slots read, ids scanned and bytes touched by one query
+    """
+    query_bits = on_bits if query_bits is None else min(query_bits, on_bits)
+    cells = pair_count(query_bits)
+    return dict(slots_read = cells, ids_scanned = cells * slot_size, bytes_read = cells * slot_size * 4)
+
+def sdrmap_bytes(sdr_size, slot_size):
+    return pair_count(sdr_size) * slot_size * 4
+
+def sdrmem_slots(mem_size, slot_size, sdr_size):
+    return min(mem_size // (slot_size * 4), pair_count(sdr_size))
+
+SLOT_SIZES = (8, 12, 16, 23, 31, 32, 48, 64, 96, 112, 128, 192, 256)
+SDR_SIZES = (256, 512, 768, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 12288, 16384)
+
+def plan(budget_bytes, items, on_bits, target_recall = 0.95, query_bits = None, noise = 0,
+         sdr_size = None, thresh = SDRMEM_THRESH, slot_sizes = SLOT_SIZES, sdr_sizes = SDR_SIZES):
+    """
+    lists SDRMap and SDR_MEM configurations fitting in budget_bytes, each a dict with the
+    modeled recall, memory and query cost.
+    sdr_size: fixed SDR size (e.g. of an existing encoder), otherwise SDRMap tries sdr_sizes
+              and SDR_MEM gets the smallest size using all its slots (as SDR_MEM.min_sdr_size())
+    Returns (recommended, candidates): the cheapest to query of those reaching target_recall
+    (or the best recall if none does) and all candidates, best first.
+    """
+    candidates = []
+    for slot_size in slot_sizes:
+        for size in ([sdr_size] if sdr_size else sdr_sizes):
+            nbytes = sdrmap_bytes(size, slot_size)
+            if nbytes > budget_bytes or size <= on_bits:
+                continue
+            recall = recall_model(items, pair_count(size), slot_size, on_bits, query_bits, noise, SDRMAP_MIN_HITS)
+            candidates.append(dict(memory = "SDRMap", sdr_size = size, slot_size = slot_size,
+                                   mem_bytes = nbytes, recall = recall, **query_cost(on_bits, slot_size, query_bits)))
+
+        num_slots = budget_bytes // (slot_size * 4)
+        size = sdr_size if sdr_size else int((num_slots * 2) ** .5 + 1)
+        slots = sdrmem_slots(budget_bytes, slot_size, size)
+        recall = recall_model(items, slots, slot_size, on_bits, query_bits, noise, sdrmem_min_hits(thresh))
+        candidates.append(dict(memory = "SDR_MEM", sdr_size = size, slot_size = slot_size,
+                               mem_bytes = num_slots * slot_size * 4, recall = recall,
+                               **query_cost(on_bits, slot_size, query_bits)))
+
+    good = [c for c in candidates if c["recall"] >= target_recall]
+    if good:
+        recommended = min(good, key = lambda c: (c["ids_scanned"], c["mem_bytes"]))
+    else:
+        recommended = max(candidates, key = lambda c: c["recall"]) if candidates else None
+    candidates.sort(key = lambda c: (-c["recall"], c["ids_scanned"]))
+    return recommended, candidates
+
+def simulate(config, items, on_bits, query_bits = None, noise = 0, sim_items = 20000, queries = 500,
+             thresh = SDRMEM_THRESH, seed = 1):
+    """
+    stores random SDRs in a real memory configured as plan() does and returns the measured recall.
+    When items > sim_items, the memory is shrunk to keep the same writes per slot.
+    For SDRMap that means a smaller sdr_size, where random SDRs overlap more, so a scaled
+    down simulation is pessimistic.
+    """
+    from sdr_util import random_sdr_batch, near_sdr_batch
+    query_bits = on_bits if query_bits is None else min(query_bits, on_bits)
+    scale = min(1.0, sim_items / items)
+    n = max(int(items * scale), 1)
+    ids = np.arange(1, n + 1, dtype = np.uint32)
+    sdr_size = config["sdr_size"]
+    if config["memory"] == "SDRMap":
+        from sdr_mem2d import SDRMap
+        sdr_size = max(int(sdr_size * scale ** .5), on_bits * 2)
+        mem = SDRMap(sdr_size = sdr_size, slot_size = config["slot_size"])
+        mem.MAP[:] = 0
+    else:
+        from sdr_id_mem import SDR_MEM
+        slots = sdrmem_slots(config["mem_bytes"], config["slot_size"], sdr_size)
+        mem = SDR_MEM(max(int(slots * scale), 1) * config["slot_size"] * 4, slot_size = config["slot_size"])
+    keys = random_sdr_batch(n, sdr_size, on_bits, seed = seed)
+    which = np.random.RandomState(seed).choice(n, size = min(queries, n), replace = False)
+    qsdrs = near_sdr_batch(keys[which], sdr_size, noise, seed = seed + 1) if noise else keys[which]
+    qsdrs = np.sort(qsdrs[:, np.random.RandomState(seed + 2).permutation(on_bits)[:query_bits]], axis = 1)
+
+    hits = 0
+    if config["memory"] == "SDRMap":
+        mem.store(ids, keys)
+        found, _ = mem.query(list(qsdrs), first = 1)
+        hits = sum(len(f) > 0 and f[0] == ids[i] for f, i in zip(found, which))
+    else:
+        mem.store_many(keys, ids)
+        for q, i in zip(qsdrs, which):
+            found = mem.query(q, thresh)
+            hits += len(found) > 0 and found[0][1] == ids[i]
+    return hits / len(which)
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(description = "recommends SDRMap / SDR_MEM parameters for a memory budget")
+    p.add_argument("--budget-mbytes", type = float, required = True)
+    p.add_argument("--items", type = int, required = True)
+    p.add_argument("--on-bits", type = int, required = True)
+    p.add_argument("--target-recall", type = float, default = 0.95)
+    p.add_argument("--query-bits", type = int, default = None)
+    p.add_argument("--noise", type = int, default = 0, help = "bits switched in queries")
+    p.add_argument("--sdr-size", type = int, default = None, help = "fixed SDR size")
+    p.add_argument("--thresh", type = int, default = SDRMEM_THRESH, help = "SDR_MEM query threshold")
+    p.add_argument("--top", type = int, default = 8, help = "candidates to list")
+    p.add_argument("--sim-items", type = int, default = 20000, help = "0 skips the simulation")
+    args = p.parse_args()
+
+    budget = int(args.budget_mbytes * 2**20)
+    best, candidates = plan(budget, args.items, args.on_bits, args.target_recall, args.query_bits,
+                            args.noise, args.sdr_size, args.thresh)
+    if best is None:
+        print("nothing fits in this budget")
+        raise SystemExit(1)
+
+    print(f"{'memory':>8} {'sdr_size':>8} {'slot':>5} {'MB':>7} {'recall':>7} {'ids/query':>10}")
+    for c in candidates[:args.top]:
+        print(f"{c['memory']:>8} {c['sdr_size']:>8} {c['slot_size']:>5} {c['mem_bytes'] / 2**20:>7.1f} "
+              f"{c['recall']:>7.3f} {c['ids_scanned']:>10}")
+    if best["recall"] < args.target_recall:
+        print(f"\nno configuration reaches recall {args.target_recall}, best one:")
+    else:
+        print(f"\nrecommended, cheapest query reaching recall {args.target_recall}:")
+    print(best)
+    if args.sim_items:
+        measured = simulate(best, args.items, args.on_bits, args.query_bits, args.noise,
+                            args.sim_items, thresh = args.thresh)
+        scaled = f", scaled down to {args.sim_items} items" if args.items > args.sim_items else ""
+        print(f"simulated recall with random SDRs: {measured:.3f} (model {best['recall']:.3f}{scaled})")
@@ -0,0 +1,117 @@
+"""
+SDR classifier, a numba replacement for htm.core's Classifier
+
+Same model as htm.core: a weight per (bit, class), a SDR's class scores are the sums of its
+ON bits' weights, turned into probabilities by softmax. Learning is online gradient descent,
+    weights[bit] += alpha * (one_hot(label) - softmax(scores))  for each ON bit
+
+Unlike htm.core it takes whole (n, bits) arrays of sparse SDRs, so there is no per sample
+SDR object or Python loop: learn() runs the samples sequentially in one compiled call and
+infer() / predict() gather-sum all rows in parallel.
+
+    clf = SDRClassifier(sdr_size = 6240)
+    clf.learn(train_sdrs, train_labels)
+    labels = clf.predict(test_sdrs)
+"""
+import numpy as np
+import numba
+
+@numba.njit(fastmath = True, nogil = True, cache = True)
+def _learn(sdrs, labels, weights, alpha, scores):
+    num_classes = weights.shape[1]
+    for n in range(sdrs.shape[0]):
+        scores[:] = 0
+        for b in sdrs[n]:
+            for c in range(num_classes):
+                scores[c] += weights[b, c]
+        # softmax, then the error becomes scores
+        top = scores.max()
+        total = 0.0
+        for c in range(num_classes):
+            scores[c] = np.exp(scores[c] - top)
+            total += scores[c]
+        for c in range(num_classes):
+            scores[c] = -alpha * scores[c] / total
+        scores[labels[n]] += alpha
+        for b in sdrs[n]:
+            for c in range(num_classes):
+                weights[b, c] += scores[c]
+
+@numba.njit(fastmath = True, nogil = True, parallel = True, cache = True)
+def _gather_sum(sdrs, weights, out):
+    for n in numba.prange(sdrs.shape[0]):
+        for b in sdrs[n]:
+            for c in range(weights.shape[1]):
+                out[n, c] += weights[b, c]
+    return out
+
+class SDRClassifier:
+    def __init__(self, sdr_size, num_classes = 0, alpha = 0.001):
+        """
+        sdr_size: size of classified SDRs
+        num_classes: grows as larger labels are learned, if not known in advance
+        alpha: learning rate, the default is htm.core's
+        """
+        self.sdr_size = sdr_size
+        self.alpha = alpha
+        self.weights = np.zeros((sdr_size, num_classes), dtype = np.float32)
+
+    @property
+    def num_classes(self):
+        return self.weights.shape[1]
+
+    def learn(self, sdrs, labels, epochs = 1):
+        """
+        learns a (n, bits) array of sparse SDRs, labels are integers 0 ... num_classes - 1
+        """
+        sdrs = np.asarray(sdrs)
+        labels = np.asarray(labels, dtype = np.int64)
+        if labels.max() >= self.num_classes:
+            self.weights = np.pad(self.weights, ((0, 0), (0, labels.max() + 1 - self.num_classes)))
+        scores = np.empty(self.num_classes, dtype = np.float32)
+        for _ in range(epochs):
+            _learn(sdrs, labels, self.weights, np.float32(self.alpha), scores)
+
+    def scores(self, sdrs):
+        """
+        summed weights of each class, (n, num_classes)
+        """
+        sdrs = np.asarray(sdrs).reshape(-1, np.shape(sdrs)[-1])
+        return _gather_sum(sdrs, self.weights, np.zeros((len(sdrs), self.num_classes), dtype = np.float32))
+
+    def infer(self, sdrs):
+        """
+        class probabilities, (n, num_classes)
+        """
+        scores = self.scores(sdrs)
+        scores = np.exp(scores - scores.max(axis = 1, keepdims = True))
+        return scores / scores.sum(axis = 1, keepdims = True)
+
+    def predict(self, sdrs):
+        """
+        most likely class of each SDR
+        """
+        return self.scores(sdrs).argmax(axis = 1)
+
+if __name__ == "__main__":
+    from time import time
+    from sdr_util import random_sdr_batch, near_sdr_batch
+    SDR_SIZE, SDR_LEN, NUM_CLASSES = 6240, 480, 10
+    # each class is a prototype SDR, samples switch half of its bits
+    prototypes = random_sdr_batch(NUM_CLASSES, SDR_SIZE, SDR_LEN, seed = 1)
+    y_train = np.random.randint(0, NUM_CLASSES, size = 60000)
+    y_test = np.random.randint(0, NUM_CLASSES, size = 10000)
+    x_train = near_sdr_batch(prototypes[y_train], SDR_SIZE, SDR_LEN // 2, seed = 2)
+    x_test = near_sdr_batch(prototypes[y_test], SDR_SIZE, SDR_LEN // 2, seed = 3)
+
+    SDRClassifier(SDR_SIZE).learn(x_train[:10], y_train[:10])   # give numba time to compile
+    SDRClassifier(SDR_SIZE, NUM_CLASSES).predict(x_test[:10])
+    clf = SDRClassifier(SDR_SIZE)
+    t = time()
+    clf.learn(x_train, y_train)
+    t = time() - t
+    print(f"{len(x_train)} samples learned in {int(t*1000)}ms")
+    t = time()
+    pred = clf.predict(x_test)
+    t = time() - t
+    print(f"{len(x_test)} predicted in {int(t*1000)}ms, correct {(pred == y_test).mean()*100:.2f}%")
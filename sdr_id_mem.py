@@ -5,9 +5,12 @@ This is an attempt to make a cleaner, numbified sdr_mem2d.py version
 
 import numba
 import numpy as np 
+import sdr_metrics as metrics
 
+_METRICS = metrics.ENABLED   # probes are compiled out unless SDR_METRICS is set
 
-@numba.jit(nopython = True)
+
+@numba.njit(cache = True)
 def _addr(x, mem):
     num_slots = mem.shape[0]
     addr = []
@@ -16,12 +19,17 @@ def _addr(x, mem):
             addr.append((x[i]*(x[i]-1)//2 + x[j]) % num_slots)
     return addr
 
-@numba.jit
+@numba.njit(cache = True)
 def save(mem, x, yid): 
     slotsize = mem.shape[1]
     for a in _addr(x, mem): 
         mem[a,(yid * a) % slotsize] = yid
 
+@numba.njit(nogil = True, cache = True)
+def save_many(mem, sdrs, yids):
+    for i in range(len(sdrs)):
+        save(mem, sdrs[i], yids[i])
+
 def _query(mem, x, thresh = 5):
     """
     For whatever reason there-s a problem numbifying this. Probably numba couldn't
@@ -33,7 +41,7 @@ def _query(mem, x, thresh = 5):
     unique, counts = np.unique(flat, return_counts = True)
     return unique, counts
 
-@numba.jit(nopython = True)
+@numba.njit(cache = True)
 def _id_counter(mem, x, thresh = 5):
     found = {}
     for a in _addr(x, mem):
@@ -52,7 +60,7 @@ def _id_counter(mem, x, thresh = 5):
     return sorted(ret, reverse=True)
 
 
-@numba.jit(fastmath=True, nogil=True, cache=True)
+@numba.njit(fastmath = True, nogil = True, cache = True)
 def _bit_query(mem, x, thresh): 
     """
     unlike _id_counter this uses a bitmap to remove 
@@ -96,9 +104,23 @@ class SDR_MEM:
         num_slots = mem_size // (slot_size * 4) # Mem size would be specified in bytes. It won't be implicit, users have to allocate it.
                                                 # 4 is the size in bytes of an id - np.uint32
         self.mem = np.zeros((num_slots, slot_size), dtype = np.uint32)
+        self.writes = 0     # bumped by every store, invalidates cached query results
 
     def store(self, sdr, sid): 
+        if _METRICS: t = metrics.clock()
+        self.writes += 1
         save(self.mem, sdr, sid)
+        if _METRICS: self._record("store", t, len(sdr) * (len(sdr) - 1) // 2)
+
+    def store_many(self, sdrs, sids):
+        """
+        stores a batch of sdrs (2D array) with their ids in one compiled call
+        """
+        if _METRICS: t = metrics.clock()
+        sdrs = np.asarray(sdrs)
+        self.writes += 1
+        save_many(self.mem, sdrs, np.asarray(sids, dtype = np.uint32))
+        if _METRICS: self._record("store_many", t, len(sdrs) * sdrs.shape[1] * (sdrs.shape[1] - 1) // 2)
 
     def query(self, sdr, thresh = 5):
         """
@@ -107,7 +129,18 @@ class SDR_MEM:
 
         # return _id_counter(self.mem, sdr, thresh)
         # return _query(self.mem, sdr, thresh)
-        return _bit_query(self.mem, sdr, thresh)
+        if _METRICS: t = metrics.clock()
+        found = _bit_query(self.mem, sdr, thresh)
+        if _METRICS: self._record("query", t, len(sdr) * (len(sdr) - 1) // 2)
+        return found
+
+    @staticmethod
+    def _record(op, t, pairs):
+        # expansion, gathers and counting all happen in one compiled call, timed as a single phase.
+        # The kernel only returns ids above thresh, so there is no candidates count
+        metrics.phase(f"sdrmem.{op}.kernel", t)
+        metrics.observe(f"sdrmem.{op}.pairs", pairs)
+        metrics.count(f"sdrmem.{op}.calls")
 
     def num_slots(self):
         # since number of slots are computed dynamically in __init__() from mem_size and slot_size 
@@ -25,6 +25,9 @@ From a SDR with e.g. 32 bits ON, 32*31/2 = 496 point pairs can be stored in the
 
 """
 import numpy as np
+import sdr_metrics as metrics
+
+_METRICS = metrics.ENABLED   # probes are compiled out unless SDR_METRICS is set
 
 def pairs2addr(plist):
     l0,l1 = plist.T
@@ -37,20 +40,17 @@ class SDRMap():
         self.NUM_SLOTS = pairs2addr(np.array([[sdr_size-2,sdr_size-1]]))[0]+1
         self.SLOT_SIZE = slot_size
         self.MAP = np.empty((self.NUM_SLOTS, slot_size), dtype = np.uint32)
+        self.writes = 0     # bumped by every store, invalidates cached query results
 
-        self.bit_pairs = {} 
-        for size in range(5,120):
-            pairs = []
-            for b1 in range(0,size-1):
-                for b2 in range(b1+1,size):
-                    pairs.append((b1,b2))
-            pairs = np.array(pairs,dtype = np.uint32)
-            self.bit_pairs[size] = pairs
+        self.bit_pairs = {}     # SDR length -> positions of its bit pairs, filled on demand
 
     def sdr2address(self,sdr,sdr_id=None): 
         sdr.sort()
         size = len(sdr) 
-        pairs = self.bit_pairs[size]
+        pairs = self.bit_pairs.get(size)
+        if pairs is None:
+            # same (b1, b2), b1 < b2 order as nested loops over b1 then b2
+            pairs = self.bit_pairs[size] = np.array(np.triu_indices(size, 1), dtype = np.uint32).T.copy()
         slots = pairs2addr(sdr[pairs])
         np.random.seed(sdr_id)
         slotpos = np.random.randint(0,self.SLOT_SIZE, size = len(slots))
@@ -62,9 +62,16 @@ class SDRMap():
         Stores in  sdr_mem a list of sdrs. 
         sdr_list - a list of tuple containing (id sdr) each
         """
+        self.writes += 1
         for i,sdr in zip(id_list, sdr_list):
+            if _METRICS: t = metrics.clock()
             addr = self.sdr2address(sdr,i)
-            self.MAP[addr] = i
+            if _METRICS: t = metrics.phase("sdrmap.store.expand", t)
+            self._write(addr, i)
+            if _METRICS:
+                metrics.phase("sdrmap.store.write", t)
+                metrics.observe("sdrmap.store.pairs", len(addr[0]))
+                metrics.count("sdrmap.store.calls")
 
     def query_extended(self,sdrs, min_counts = 4):
         """
@@ -80,17 +87,31 @@ class SDRMap():
         value_list = []
         count_list = []
         for sdr in sdrs:
+            if _METRICS: t = metrics.clock()
             addr, slotpos = self.sdr2address(sdr)
-            vals = self.MAP[addr]
+            if _METRICS: t = metrics.phase("sdrmap.query.expand", t)
+            vals = self._read(addr)
+            if _METRICS: t = metrics.phase("sdrmap.query.gather", t)
             values, counts = np.unique(vals, return_counts=True)
+            if _METRICS:
+                metrics.phase("sdrmap.query.count", t)
+                metrics.observe("sdrmap.query.pairs", len(addr))
+                metrics.observe("sdrmap.query.candidates", len(values))
+                metrics.count("sdrmap.query.calls")
             which = counts > min_counts
             value_list.append(values[which])
             count_list.append(counts[which])
         return value_list, count_list
 
+    def _write(self, addr, sdr_id):
+        self.MAP[addr] = sdr_id
+
+    def _read(self, slots):
+        return self.MAP[slots]
+
     def raw_query(self,sdr):
         addr, _ = self.sdr2address(sdr)
-        return self.MAP[addr]
+        return self._read(addr)
 
     def query(self, sdrs, first=4):
         """
@@ -103,23 +124,71 @@ class SDRMap():
         """
         id_list, count_list = self.query_extended(sdrs)
         id_out, count_out = [], []
-        for i, sdr in enumerate(sdrs):
-            ids = id_list[i]
-            counts = count_list[i] 
-            if ids.size < 2:
-                id_out.append(ids)
-                count_out.append(counts)
-                continue
-            if ids[0] == 0: 
-                ids = ids[1:]
-                counts = counts[1:]
-            upto = min(first, len(ids))
-            ordered = np.flip(np.argsort(counts))[0:upto]
-            id_out.append(ids[ordered])
-            count_out.append(counts[ordered])
+        for ids, counts in zip(id_list, count_list):
+            if _METRICS: t = metrics.clock()
+            if ids.size >= 2:
+                if ids[0] == 0: 
+                    ids = ids[1:]
+                    counts = counts[1:]
+                upto = min(first, len(ids))
+                ordered = np.flip(np.argsort(counts))[0:upto]
+                ids, counts = ids[ordered], counts[ordered]
+            id_out.append(ids)
+            count_out.append(counts)
+            if _METRICS: metrics.phase("sdrmap.query.topk", t)   # per SDR, like the other query phases
         return id_out, count_out
 
 
+class RollingSDRMap(SDRMap):
+    """
+    SDRMap for endless streams which only need to recall recent items.
+
+    Each slot is split between `generations` rotating generations, MAP is
+    (generations, NUM_SLOTS, slot_size // generations). Stores write only into the current
+    generation, queries count ids over all of them. rotate() makes the oldest generation
+    current and zeroes it, which costs its size, not the whole map's.
+    So memory is bounded and recall of the last few generations stays stable no matter
+    how many items went in before.
+
+    generation_items: rotate automatically after that many stores, None rotates only on rotate() calls
+
+    Cleared cells read as id 0, which queries drop anyway, so don't store id 0.
+    """
+    def __init__(self, sdr_size = 2048, slot_size = 64, generations = 4, generation_items = None):
+        assert slot_size % generations == 0, "slot_size must be a multiple of generations"
+        super().__init__(sdr_size, slot_size // generations)
+        self.GENERATIONS = generations
+        self.MAP = np.zeros((generations, self.NUM_SLOTS, self.SLOT_SIZE), dtype = np.uint32)
+        self.generation_items = generation_items
+        self.current = 0
+        self.items = np.zeros(generations, dtype = np.int64)   # stores in each generation
+
+    def rotate(self):
+        """
+        drops the oldest generation, new stores go into its (cleared) space
+        """
+        if _METRICS: t = metrics.clock()
+        self.current = (self.current + 1) % self.GENERATIONS
+        self.writes += 1
+        self.MAP[self.current] = 0
+        self.items[self.current] = 0
+        if _METRICS:
+            metrics.phase("sdrmap.rotate.clear", t)
+            metrics.count("sdrmap.rotate.calls")
+
+    def _write(self, addr, sdr_id):
+        if self.generation_items is not None and self.items[self.current] >= self.generation_items:
+            self.rotate()
+        self.MAP[self.current][addr] = sdr_id
+        self.items[self.current] += 1
+
+    def _read(self, slots):
+        return self.MAP[:, slots]
+
+    @property
+    def live_items(self):
+        return int(self.items.sum())
+
 
 if __name__ == "__main__":
     from time import time,sleep
@@ -184,3 +253,19 @@ if __name__ == "__main__":
     for i in (500,501,502,100,101,102):
         print("result for:", i, " ids:" , l_ids[0][i], " counts:", l_counts[0][i])
 
+    # Streaming: 4 generations of 25k items in the same slot size, recall of the most
+    # recent items stays put while 300k go through, items older than 4 generations are gone
+    rolling = RollingSDRMap(slot_size = 112, generations = 4, generation_items = 25_000)
+    ids = np.arange(1, 30 * NUM_SDRS + 1, dtype = np.uint32)
+    first_sdrs = None
+    def recall(sdrs, sdr_ids):
+        found, _ = rolling.query(sdrs[:, :16], first = 1)
+        return np.mean([len(f) > 0 and f[0] == i for f, i in zip(found, sdr_ids)]) * 100
+    for start in range(0, len(ids), NUM_SDRS):
+        sdrs = genRandomSDRs(NUM_SDRS)
+        first_sdrs = sdrs if first_sdrs is None else first_sdrs
+        rolling.store(ids[start:start + NUM_SDRS], sdrs)
+        if start % (5 * NUM_SDRS) == 0:
+            print(f"rolling map, {start + NUM_SDRS} stored, {rolling.live_items} live, "
+                  f"recall of last {NUM_SDRS}: {recall(sdrs, ids[start:]):.1f}%, "
+                  f"of first {NUM_SDRS}: {recall(first_sdrs, ids):.1f}%")
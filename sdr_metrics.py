@@ -0,0 +1,142 @@
+"""
+Opt-in instrumentation for the memories' hot paths
+
+Disabled unless the SDR_METRICS environment variable is set (and not "0") before the memories
+are imported. Each instrumented module copies ENABLED into a module constant and guards its
+probes with it, so when disabled they cost a constant false test, nothing else.
+
+    $ SDR_METRICS=1 python3 fh_am_test.py
+
+Probes record, per call:
+    <memory>.<op>.<phase>_ns   time per phase, e.g. sdrmap.query.gather_ns
+    <memory>.<op>.pairs        bit pairs (or triples) expanded, each reads or writes one slot / row
+    sdrmap.query.candidates    distinct ids counted (the other memories count inside compiled code)
+into histograms with power of two buckets, plus calls counters.
+A call is one SDR for single SDR ops and one batch for *_many ops. SDRMap.store / query
+take lists but are recorded per SDR, all their phases included.
+
+snapshot() returns all of it as a dict, text() in Prometheus text format, serve(port)
+exposes text() over http from a background thread.
+Recording is not locked, counts from concurrent threads are approximate.
+"""
+import os
+from time import perf_counter_ns as clock
+
+ENABLED = os.environ.get("SDR_METRICS", "") not in ("", "0")
+
+BUCKETS = 64
+
+class Histogram:
+    """
+    counts values in power of two buckets: bucket b holds values in [2**(b-1), 2**b)
+    """
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (BUCKETS + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        self.counts[min(value.bit_length(), BUCKETS)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q quantile
+        """
+        rank = q * self.count
+        seen = 0
+        for b, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return min(2 ** b - 1, self.max)
+        return self.max
+
+    def snapshot(self):
+        return dict(count = self.count, sum = self.sum, max = self.max,
+                    mean = self.sum / self.count if self.count else 0.0,
+                    p50 = self.quantile(.5), p90 = self.quantile(.9), p99 = self.quantile(.99),
+                    buckets = {2 ** b - 1: c for b, c in enumerate(self.counts) if c})
+
+_histograms = {}
+_counters = {}
+
+def observe(name, value):
+    h = _histograms.get(name)
+    if h is None:
+        h = _histograms[name] = Histogram()
+    h.record(value)
+
+def count(name, n = 1):
+    _counters[name] = _counters.get(name, 0) + n
+
+def phase(name, start):
+    """
+    records the time since start (a clock() value) as name_ns, returns the current clock()
+    so consecutive phases chain: t = phase("x.expand", t); ...; t = phase("x.gather", t)
+    """
+    now = clock()
+    observe(name + "_ns", now - start)
+    return now
+
+def reset():
+    _histograms.clear()
+    _counters.clear()
+
+def snapshot():
+    """
+    all counters and histograms summaries as a dict
+    """
+    return dict(counters = dict(_counters),
+                histograms = {name: h.snapshot() for name, h in _histograms.items()})
+
+def _metric_name(name):
+    return "sdr_" + name.replace(".", "_")
+
+def text():
+    """
+    Prometheus text format of all metrics
+    """
+    lines = []
+    for name, value in sorted(_counters.items()):
+        n = _metric_name(name)
+        lines += [f"# TYPE {n} counter", f"{n} {value}"]
+    for name, h in sorted(_histograms.items()):
+        n = _metric_name(name)
+        lines.append(f"# TYPE {n} histogram")
+        seen = 0
+        for b, c in enumerate(h.counts):
+            seen += c
+            if c:
+                lines.append(f'{n}_bucket{{le="{2 ** b - 1}"}} {seen}')
+        lines += [f'{n}_bucket{{le="+Inf"}} {h.count}', f"{n}_sum {h.sum}", f"{n}_count {h.count}"]
+    return "\n".join(lines) + "\n"
+
+def serve(port = 9108, host = "127.0.0.1"):
+    """
+    serves text() at http://host:port/metrics from a daemon thread, returns the server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import threading
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
@@ -0,0 +1,193 @@
+"""
+Encode -> store -> query -> vote pipeline, parametrized from the command line
+
+Generalizes fh_am_test.py: train rows are fly hash encoded and stored in an associative memory
+with their row number as ID, test rows are encoded and queried, then the labels of returned IDs
+vote (weighted by their pair counts) for each test row's class.
+Each stage reports its time, throughput and memory so sdr_size, slot_size, spread etc.
+can be tuned on any dataset without editing code.
+
+    $ python3 sdr_pipeline.py                                   # MNIST, like fh_am_test.py
+    $ python3 sdr_pipeline.py --train-rows 20000 --slot-size 64 --spread 100
+    $ python3 sdr_pipeline.py --train x.npy --train-labels y.npy --test xt.npy --test-labels yt.npy
+    $ python3 sdr_pipeline.py --memory sdrmem --mem-mbytes 512
+
+"""
+import numpy as np
+import argparse, os, resource
+from time import time
+
+from fly_hash_encoder import FHEncoder
+
+def rss_mbytes():
+    """
+    current resident memory of this process in MBytes, peak resident memory where /proc is missing
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+class Stages:
+    """
+    collects per stage time, throughput and memory
+    """
+    def __init__(self, verbose = True):
+        self.records = []
+        self.verbose = verbose
+
+    def run(self, name, rows, func, *args, **kwargs):
+        rss = rss_mbytes()
+        t = time()
+        ret = func(*args, **kwargs)
+        t = time() - t
+        rec = dict(stage = name, rows = rows, seconds = t, rows_per_sec = rows / max(t, 1e-9),
+                   rss_mbytes = rss_mbytes(), rss_delta_mbytes = rss_mbytes() - rss)
+        self.records.append(rec)
+        if self.verbose:
+            print(f"{name:>8}: {rows} rows in {int(t*1000)}ms, {int(rec['rows_per_sec'])} rows/s, "
+                  f"rss {int(rec['rss_mbytes'])}MB ({rec['rss_delta_mbytes']:+.1f}MB)")
+        return ret
+
+    def summary(self):
+        return self.records
+
+def vote(id_lists, count_lists, id_labels, num_classes):
+    """
+    Vectorized vote over query results: each returned id adds its count to its label's score.
+    id_lists, count_lists: per query arrays of ids and counts, as returned by SDRMap.query()
+    id_labels: array mapping id -> label, or a callable vectorized over an id array
+    returns (predicted labels, votes array of shape (queries, num_classes))
+    """
+    lengths = np.fromiter((len(ids) for ids in id_lists), dtype = np.int64, count = len(id_lists))
+    votes = np.zeros((len(id_lists), num_classes), dtype = np.float64)
+    if lengths.sum():
+        ids = np.concatenate(id_lists)
+        counts = np.concatenate(count_lists)
+        labels = id_labels(ids) if callable(id_labels) else id_labels[ids]
+        rows = np.repeat(np.arange(len(id_lists)), lengths)
+        np.add.at(votes, (rows, labels), counts)
+    return votes.argmax(axis = 1), votes
+
+class SDRMapBackend:
+    def __init__(self, args):
+        from sdr_mem2d import SDRMap
+        self.mem = SDRMap(sdr_size = args.sdr_size, slot_size = args.slot_size)
+        self.first = args.first
+
+    def store(self, ids, sdrs):
+        self.mem.store(ids, sdrs)
+
+    def query(self, sdrs):
+        return self.mem.query(sdrs, first = self.first)
+
+    def nbytes(self):
+        return self.mem.MAP.nbytes
+
+class SDRMemBackend:
+    def __init__(self, args):
+        from sdr_id_mem import SDR_MEM
+        self.mem = SDR_MEM(args.mem_mbytes * 2**20, slot_size = args.slot_size)
+        self.first = args.first
+        self.thresh = args.thresh
+
+    def store(self, ids, sdrs):
+        self.mem.store_many(sdrs, ids)
+
+    def query(self, sdrs):
+        id_lists, count_lists = [], []
+        for sdr in sdrs:
+            found = self.mem.query(sdr, self.thresh)[:self.first]
+            id_lists.append(np.array([yid for _, yid in found], dtype = np.uint32))
+            count_lists.append(np.array([cnt for cnt, _ in found], dtype = np.int64))
+        return id_lists, count_lists
+
+    def nbytes(self):
+        return self.mem.mem.nbytes
+
+BACKENDS = {"sdrmap": SDRMapBackend, "sdrmem": SDRMemBackend}
+
+def load_data(args):
+    if args.train is None:
+        import load_mnist_data as mnist
+        x_train, y_train, x_test, y_test = mnist.x_train, mnist.y_train, mnist.x_test, mnist.y_test
+    else:
+        x_train, x_test = np.load(args.train, mmap_mode = 'r'), np.load(args.test, mmap_mode = 'r')
+        y_train, y_test = np.load(args.train_labels), np.load(args.test_labels)
+    train_rows = slice(args.train_start, args.train_start + args.train_rows if args.train_rows else None)
+    test_rows = slice(0, args.test_rows if args.test_rows else None)
+    return x_train[train_rows], y_train[train_rows], x_test[test_rows], y_test[test_rows]
+
+def run(args):
+    """
+    runs the whole pipeline, returns a dict with parameters, per stage records and accuracy
+    """
+    stages = Stages(verbose = not args.quiet)
+    x_train, y_train, x_test, y_test = stages.run("load", 0, load_data, args)
+    y_train = np.asarray(y_train, dtype = np.int64)
+    num_classes = int(max(y_train.max(), np.max(y_test)) + 1)
+
+    encoder = FHEncoder(sdr_size = args.sdr_size, random_seed = args.seed, spread = args.spread,
+                        sparse = not args.dense)
+    stages.run("factors", min(len(x_train), args.fit_rows), encoder.init_factors, x_train[:args.fit_rows])
+
+    memory = BACKENDS[args.memory](args)
+    sdrs = stages.run("encode", len(x_train), encoder.encode_parallel, x_train,
+                      sdr_len = args.store_len, workers = args.workers)
+    # ids are row numbers + 1, 0 being the empty slot marker
+    ids = np.arange(1, len(x_train) + 1, dtype = np.uint32)
+    stages.run("store", len(ids), memory.store, ids, sdrs)
+
+    qsdrs = stages.run("encode", len(x_test), encoder.encode_parallel, x_test,
+                       sdr_len = args.query_len, workers = args.workers)
+    id_lists, count_lists = stages.run("query", len(qsdrs), memory.query, qsdrs)
+
+    id_labels = np.concatenate([[0], y_train])
+    preds, _ = stages.run("vote", len(qsdrs), vote, id_lists, count_lists, id_labels, num_classes)
+    accuracy = float((preds == np.asarray(y_test)).mean())
+    if not args.quiet:
+        print(f"memory {memory.nbytes() // 2**20}MB, accuracy {accuracy*100:.2f}%")
+    return dict(params = vars(args), stages = stages.summary(), memory_bytes = memory.nbytes(),
+                accuracy = accuracy)
+
+def parser():
+    p = argparse.ArgumentParser(description = __doc__.split("\n\n")[0].strip())
+    data = p.add_argument_group("data (MNIST if no --train is given)")
+    data.add_argument("--train", help = "train rows .npy file")
+    data.add_argument("--train-labels", help = "train labels .npy file")
+    data.add_argument("--test", help = "test rows .npy file")
+    data.add_argument("--test-labels", help = "test labels .npy file")
+    data.add_argument("--train-start", type = int, default = 0)
+    data.add_argument("--train-rows", type = int, default = 0, help = "0 for all")
+    data.add_argument("--test-rows", type = int, default = 0, help = "0 for all")
+
+    enc = p.add_argument_group("encoder")
+    enc.add_argument("--sdr-size", type = int, default = 2048)
+    enc.add_argument("--spread", type = int, default = 200)
+    enc.add_argument("--seed", type = int, default = 3)
+    enc.add_argument("--dense", action = "store_true", help = "dense projection instead of sparse")
+    enc.add_argument("--fit-rows", type = int, default = 10000, help = "rows used to compute factors")
+    enc.add_argument("--store-len", type = int, default = 32, help = "ON bits of stored SDRs")
+    enc.add_argument("--query-len", type = int, default = 32, help = "ON bits of query SDRs")
+    enc.add_argument("--workers", type = int, default = None)
+
+    mem = p.add_argument_group("memory")
+    mem.add_argument("--memory", choices = sorted(BACKENDS), default = "sdrmap")
+    mem.add_argument("--slot-size", type = int, default = 112)
+    mem.add_argument("--mem-mbytes", type = int, default = 1024, help = "sdrmem size")
+    mem.add_argument("--thresh", type = int, default = 5, help = "sdrmem minimum pair hits")
+    mem.add_argument("--first", type = int, default = 8, help = "best ids returned by each query")
+
+    p.add_argument("--json", help = "also write results to this .json file")
+    p.add_argument("--quiet", action = "store_true")
+    return p
+
+if __name__ == "__main__":
+    import json
+    args = parser().parse_args()
+    assert (args.train is None) == (args.test is None), "--train and --test go together"
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,137 @@
+"""
+Precompiles all hot numba kernels into numba's on-disk cache
+
+Kernels are declared with cache = True, so a compiled kernel is reused by later processes,
+but each one still compiles on its first call in a fresh install, which costs seconds.
+Run this once at deploy time (or in a Docker build step) to fill the cache:
+
+    $ python3 sdr_precompile.py
+
+SIGNATURES lists explicit signatures of the kernels called from Python, for the dtypes the
+modules use: uint32 sparse SDRs, uint64 packed bits, int32 / float32 (decaying) value maps,
+uint8 SDM memories, uint8 or float32 fly hash inputs. Kernels stay lazy for other types,
+which then compile (and get cached) on first use as before.
+Kernels called by other kernels are compiled into their callers.
+Numba generators (ValueCorrMap.query()'s) are not cached, they compile on first use in each process.
+
+The cache lives in __pycache__ next to each module, NUMBA_CACHE_DIR moves it if that is read only.
+"""
+import importlib
+from time import time
+from numba import types
+
+u8, i32, i64, u32, u64 = types.uint8, types.int32, types.int64, types.uint32, types.uint64
+f32, f64, b1 = types.float32, types.float64, types.boolean
+
+def arr(dtype, ndim = 1, layout = 'C', readonly = False):
+    return types.Array(dtype, ndim, layout, readonly = readonly)
+
+SDR, SDRS = arr(u32), arr(u32, 2)
+BITS, BITS2 = arr(u64), arr(u64, 2)
+STAMPS = arr(u32)
+
+def _value_map_signatures():
+    sigs = {name: [] for name in ("_value_add2", "_value_add3", "_value_score2", "_value_score3", "_value_add_many",
+                                  "_value_score_many", "_value_query_into", "_value_query_many", "_value_anomalous")}
+    for dtype in (i32, f32):
+        vmap = arr(dtype)
+        common = (vmap, STAMPS, i64, f64)
+        for value in (i64, dtype):
+            sigs["_value_add2"].append((SDR, vmap, value, STAMPS, i64, f64))
+            sigs["_value_add3"].append((SDR, vmap, value, STAMPS, i64, f64, i64))
+        for layout in ('C', 'A'):
+            # add_many() values are broadcast, read only, views
+            sigs["_value_add_many"].append((SDRS, vmap, arr(dtype, 1, layout, True), STAMPS, i64, f64, i64, i64))
+        sigs["_value_score2"].append((SDR,) + common)
+        sigs["_value_score3"].append((SDR,) + common + (i64,))
+        sigs["_value_score_many"].append((SDRS,) + common + (i64, i64))
+        sigs["_value_query_into"].append((SDR,) + common + (i64, i64, arr(i32, 2), arr(f64)))
+        sigs["_value_query_many"].append((SDRS,) + common + (i64, i64, arr(i32, 3), arr(f64, 2)))
+        sigs["_value_anomalous"].append((SDR,) + common + (i64, i64, arr(i32, 2), arr(f64), i64, f64))
+    return sigs
+
+def _fly_hash_signatures():
+    sigs = {"_dense_sdrs": [(arr(f32, 2), arr(f32), SDRS)], "_top_sums": [(arr(u32, 2), arr(f64, 2), i64)]}
+    for x in (arr(u8, 2), arr(f32, 2)):
+        sigs.setdefault("_sparse_sdrs", []).append((x, arr(u32, 2), arr(f32), SDRS))
+        sigs.setdefault("_sparse_scores", []).append((x, arr(u32, 2), arr(f32, 2)))
+        sigs.setdefault("_sparse_hist", []).append((x, arr(u32, 2), f64, arr(u32, 2), arr(f64, 2)))
+        sigs.setdefault("_dense_hist", []).append((arr(f32, 2), x, f64, arr(u32, 2), arr(f64, 2)))
+        sigs.setdefault("_max_score", []).append((arr(f32, 2), x))
+    return sigs
+
+SIGNATURES = {
+    "sdr_util": {
+        "sdr_overlap": [(SDR, SDR)],
+        "sdr_distance": [(SDR, SDR)],
+        "sdr_union": [(SDR, SDR)],
+        "sdr_intersection": [(SDR, SDR)],
+        "sdr_to_bits": [(SDR, i64)],
+        "sdrs_to_bits": [(SDRS, i64)],
+        "bits_to_sdr": [(BITS,)],
+        "bits_count": [(BITS2,)],
+        "bits_overlap": [(BITS, BITS)],
+        "bits_distance": [(BITS, BITS)],
+        "bits_union": [(BITS, BITS)],
+        "bits_intersection": [(BITS, BITS)],
+        "bits_overlaps": [(BITS, BITS2)],
+        "bits_unions": [(BITS, BITS2)],
+        "bits_intersections": [(BITS, BITS2)],
+        "bits_distances": [(BITS, BITS2)],
+        "_knn_tiles": [(BITS2, arr(i64), b1, BITS2, arr(i64), b1, i64, arr(f64, 2), arr(i64, 2))],
+        "_postings_merge": [(arr(i64), arr(u32), SDRS, i64, arr(i64), arr(u32))],
+        "_index_query": [(SDRS, arr(i64), arr(u32), arr(i64), b1, arr(f64, 2), arr(i64, 2), i64)],
+        "random_sdr": [(i64, i64)],
+        "near_sdr": [(SDR, i64, i64)],
+        "_random_batch": [(i64, i64, SDRS, i64)],
+        "_near_batch": [(i64, SDRS, i64, i64, SDRS, i64)],
+        "_near_chain": [(i64, i64, i64, SDRS)],
+    },
+    "sdr_value_map": _value_map_signatures(),
+    "sdr_id_mem": {
+        "save": [(arr(u32, 2), SDR, i64), (arr(u32, 2), SDR, u32)],
+        "save_many": [(arr(u32, 2), SDRS, arr(u32))],
+        "_bit_query": [(arr(u32, 2), SDR, i64)],
+    },
+    "sdrsdm": {
+        "store_xy": [(arr(u8, 2), SDR, SDR)],
+        "query": [(arr(u8, 2), i64, SDR)],
+        "store_xyz": [(arr(u8, 3), SDR, SDR, SDR)],
+        "queryX": [(arr(u8, 3), i64, SDR, SDR)],
+        "queryY": [(arr(u8, 3), i64, SDR, SDR)],
+        "queryZ": [(arr(u8, 3), i64, SDR, SDR)],
+        "randomSDR": [(i64, i64, i64)],
+    },
+    "fly_hash_encoder": _fly_hash_signatures(),
+    "scalar_encoder": {
+        "_encode": [(arr(f64, 2), arr(f64), arr(f64), arr(i64), arr(i64), arr(i64), SDRS)],
+    },
+    "sdr_classifier": {
+        "_learn": [(SDRS, arr(i64), arr(f32, 2), f32, arr(f32))],
+        "_gather_sum": [(SDRS, arr(f32, 2), arr(f32, 2))],
+    },
+}
+
+def precompile(modules = None, verbose = False):
+    """
+    compiles (or loads from cache) every signature in SIGNATURES, for all or only the named modules.
+    returns {module: seconds}
+    """
+    timings = {}
+    for mod_name, kernels in SIGNATURES.items():
+        if modules is not None and mod_name not in modules:
+            continue
+        t = time()
+        mod = importlib.import_module(mod_name)
+        for name, sigs in kernels.items():
+            for sig in sigs:
+                getattr(mod, name).compile(sig)
+        timings[mod_name] = time() - t
+        if verbose:
+            print(f"{mod_name:>18}: {sum(map(len, kernels.values()))} signatures in {int(timings[mod_name]*1000)}ms")
+    return timings
+
+if __name__ == "__main__":
+    t = time()
+    precompile(verbose = True)
+    print(f"all kernels ready in {time() - t:.2f}s")
@@ -0,0 +1,216 @@
+"""
+Chunked dataset streaming for encoder -> memory pipelines
+
+Datasets too large for RAM are read as fixed size chunks of rows, from
+    - numpy arrays or memory mapped arrays
+    - .npy files (memory mapped)
+    - .npz members, read incrementally from the zip even when compressed
+    - any iterable of arrays (e.g. a generator), re-chunked to fixed size
+
+Chunks are prefetched by a background thread, and ingest() also encodes on a background thread,
+so reading, encoding and storing overlap while memory stays bounded by a few chunks.
+
+Example, storing fly hashes of a large .npy dataset into a SDRMap:
+
+    stream = ChunkStream("digits.npy", chunk_size = 10000)
+    ingest(stream, encoder, lambda start, sdrs: smap.store(ids[start:start + len(sdrs)], sdrs))
+
+"""
+import numpy as np
+import threading, queue, zipfile
+
+CHUNK_SIZE = 4096
+
+_END = object()
+
+def prefetched(iterable, depth = 2):
+    """
+    iterates iterable on a background thread, up to depth items ahead of the consumer.
+    Exceptions raised by the producer are re-raised in the consumer.
+    If the consumer stops early the producer stops too, and closes iterable when it is
+    a generator, so nested prefetchers all shut down their threads.
+    """
+    items = queue.Queue(maxsize = depth)
+    stop = threading.Event()
+    source = iter(iterable)
+
+    def put(item):
+        # a blocked put gives up once the consumer is gone
+        while not stop.is_set():
+            try:
+                items.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in source:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(e)
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def _npz_chunks(fname, key, chunk_size):
+    # reads a .npz member chunk by chunk, without loading (or decompressing) all of it
+    with zipfile.ZipFile(fname) as zf, zf.open(key + ".npy") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        assert not fortran_order, "fortran ordered arrays can't be streamed by rows"
+        row_shape = shape[1:]
+        row_bytes = int(np.prod(row_shape, dtype = np.int64)) * dtype.itemsize
+        for start in range(0, shape[0], chunk_size):
+            rows = min(chunk_size, shape[0] - start)
+            chunk = np.frombuffer(f.read(rows * row_bytes), dtype = dtype)
+            yield chunk.reshape((rows,) + row_shape)
+
+def _array_chunks(x, chunk_size):
+    # memory mapped chunks are copied, that is where their pages are actually read, on the
+    # prefetch thread. In memory arrays are yielded as views
+    copy = isinstance(x, np.memmap)
+    for start in range(0, x.shape[0], chunk_size):
+        chunk = x[start:start + chunk_size]
+        yield np.array(chunk) if copy else chunk
+
+def _rechunk(arrays, chunk_size):
+    # joins/splits arbitrary sized arrays into chunk_size rows
+    pending, rows = [], 0
+    for a in arrays:
+        pending.append(a)
+        rows += len(a)
+        if rows >= chunk_size:
+            joined = np.concatenate(pending)
+            full = (rows // chunk_size) * chunk_size
+            for start in range(0, full, chunk_size):
+                yield joined[start:start + chunk_size]
+            pending, rows = ([joined[full:]], rows - full) if rows > full else ([], 0)
+    if rows:
+        yield np.concatenate(pending)
+
+class ChunkStream:
+    """
+    Fixed size chunks of rows from a dataset, see module doc for sources.
+    Iterating yields (start row, chunk) tuples like FHEncoder.encode_iter()
+
+    source: array, path to a .npy or .npz file, or an iterable of arrays
+    key: the member name for .npz files
+    chunk_size: rows per chunk, the last one may be shorter
+    prefetch: how many chunks are read ahead by a background thread, 0 disables it
+    """
+    def __init__(self, source, key = None, chunk_size = CHUNK_SIZE, prefetch = 2):
+        self.source = source
+        self.key = key
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+
+    def __len__(self):
+        """
+        number of rows, when known in advance
+        """
+        if not hasattr(self.source, "shape") and not isinstance(self.source, str):
+            raise TypeError("length of a generator stream is not known in advance")
+        return self.shape[0]
+
+    @property
+    def shape(self):
+        source = self.source
+        if isinstance(source, str) and source.endswith(".npz"):
+            with zipfile.ZipFile(source) as zf, zf.open(self.key + ".npy") as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    return np.lib.format.read_array_header_1_0(f)[0]
+                return np.lib.format.read_array_header_2_0(f)[0]
+        if isinstance(source, str):
+            return np.load(source, mmap_mode = 'r').shape
+        return source.shape
+
+    def chunks(self):
+        """
+        chunks without the (start row, ...) numbering and without prefetch
+        """
+        source = self.source
+        if isinstance(source, str) and source.endswith(".npz"):
+            assert self.key is not None, "specify which .npz member to stream"
+            return _npz_chunks(source, self.key, self.chunk_size)
+        if isinstance(source, str):
+            return _array_chunks(np.load(source, mmap_mode = 'r'), self.chunk_size)
+        if isinstance(source, np.ndarray):
+            return _array_chunks(source, self.chunk_size)
+        return _rechunk(source, self.chunk_size)
+
+    def __iter__(self):
+        chunks = self.chunks()
+        if self.prefetch:
+            chunks = prefetched(chunks, self.prefetch)
+        start = 0
+        for chunk in chunks:
+            yield start, chunk
+            start += len(chunk)
+
+def encoded(stream, encoder, sdr_len = 32):
+    """
+    yields (start row, sdrs) encoding each (start row, chunk) of stream with a FHEncoder.
+    The encoder must already have its projection and factors, e.g. from partial_fit()
+    """
+    for start, chunk in stream:
+        yield start, encoder.encode_chunk(chunk, sdr_len)
+
+def ingest(stream, encoder, store, sdr_len = 32, prefetch = 2):
+    """
+    Pipelined encode -> store. Chunks are read by stream's own thread, encoded on
+    another background thread, and passed to store(start row, sdrs) on the calling thread.
+    store is any callable, e.g. wrapping SDRMap.store(), SDR_MEM.store_many() or ValueCorrMap.add_many()
+    returns the number of rows stored
+    """
+    rows = 0
+    for start, sdrs in prefetched(encoded(stream, encoder, sdr_len), prefetch):
+        store(start, sdrs)
+        rows += len(sdrs)
+    return rows
+
+if __name__ == "__main__":
+    from fly_hash_encoder import FHEncoder
+    from sdr_mem2d import SDRMap
+    from time import time
+    import os, tempfile
+
+    NUM_ROWS = 200_000
+    fname = os.path.join(tempfile.mkdtemp(), "data.npy")
+    data = np.lib.format.open_memmap(fname, mode = "w+", dtype = np.uint8, shape = (NUM_ROWS, 784))
+    for start, chunk in ChunkStream(np.random.randint(0, 256, size = (NUM_ROWS, 784), dtype = np.uint8)):
+        data[start:start + len(chunk)] = chunk * (np.random.random(chunk.shape) < 0.2)
+    data.flush()
+
+    encoder = FHEncoder(sdr_size = 2048, spread = 200, sparse = True)
+    encoder.init_factors(data[:10000])
+    smap = SDRMap(sdr_size = 2048, slot_size = 64)
+    ids = np.arange(NUM_ROWS, dtype = np.uint32) + 1
+
+    t = time()
+    rows = ingest(ChunkStream(fname, chunk_size = 10000), encoder,
+                  lambda start, sdrs: smap.store(ids[start:start + len(sdrs)], sdrs))
+    t = time() - t
+    print(f"{rows} rows streamed from {fname}, encoded and stored in {int(t*1000)}ms")
@@ -6,15 +6,36 @@ SDR distance measurement runs at over 2M/sec for the same, 40 bit size test
 
 Functions:
     near_sdr()    - changes a number of bits in the input SDR 
-    near_sdrs()   - generates a list of neighboring SDRs 
-    random_sdrs() - generates a list of random SDRs - two consecutive
+    near_sdrs()   - generates an array of neighboring SDRs 
+    random_sdrs() - generates an array of random SDRs - two consecutive
                     ones have zero overlap
+    random_sdr_batch(), near_sdr_batch() - parallel, seeded generators 
+                    of (num_sdrs, bits) arrays
                 
     sdr_overlap() - measures overlap in bits between two SDRs
     sdr_distance()- a metric of distance between two SDRs
 
     Beware both sdr_overlap and sdr_distance work on sorted SDRs
 
+Packed bits SDRs:
+    Same SDRs as bitsets, uint64 words of sdr_size bits. 
+    Overlaps become popcounts of AND-ed words, which is faster than 
+    merging sparse lists for not so sparse SDRs.
+
+    sdr_to_bits(), sdrs_to_bits()  - sparse to packed conversions
+    bits_to_sdr(), bits_to_sdrs()  - packed to sparse conversions
+    bits_overlap(), bits_distance()- same as sdr_overlap/sdr_distance on packed SDRs
+    bits_union(), bits_intersection()
+    bits_overlaps(), bits_distances() - one packed SDR against each row of a packed SDR array
+    bits_unions(), bits_intersections() - same, returning a packed SDR array
+    bits_count()   - number of ON bits in each row
+
+Exact search:
+    knn_search()   - brute force top-k by overlap or sdr_distance for a batch of queries
+                     against a database of (sparse or packed) SDRs, in parallel tiles
+    SDRIndex       - inverted index (a posting list per bit), top-k by walking 
+                     only the query bits' posting lists
+
 Copyright Cezar Totth 2022
 
 Use this as you wish, without any warranties or restrictions 
@@ -24,7 +45,7 @@ import numpy as np
 import numba
 
 # This is a "naive" python implementation which "compiles" well in numba
-@numba.njit(fastmath = True)
+@numba.njit(fastmath = True, cache = True)
 def sdr_overlap(n1,n2):
     """
     returns number of number overlapping bits between two input SDRs
@@ -42,43 +63,56 @@ def sdr_overlap(n1,n2):
         i1 += 1
     return out
 
-@numba.njit(fastmath=True)
+@numba.njit(fastmath = True, cache = True)
 def sdr_intersection(n1, n2): 
     """
     returns bits found in both n1 and n2
     """
-    out = [] 
+    out = np.empty(min(n1.size, n2.size), dtype = np.uint32)
+    n = 0
     i1, i2 = 0, 0
     while i1 < n1.size and i2 < n2.size:
         v1, v2 = n1[i1], n2[i2]
         if v1 == v2:
-            out.append(v1)
+            out[n] = v1
+            n += 1
             i2 += 1
         elif v1 > v2:
             i2 += 1
             continue
         i1 += 1
-    return np.array(out, dtype = np.uint32)
+    return out[:n]
 
-@numba.njit(fastmath = True)
+@numba.njit(fastmath = True, cache = True)
 def sdr_union(n1,n2): 
-    out = []
+    out = np.empty(n1.size + n2.size, dtype = np.uint32)
+    n = 0
     i1, i2 = 0, 0
     while i1 < n1.size and i2 < n2.size:
         v1, v2 = n1[i1], n2[i2]
         if v1 == v2:
-            # out.append(v1)
             i2 += 1
         elif v1 > v2:
-            out.append(v2)
+            out[n] = v2
+            n += 1
             i2 += 1
             continue
-        out.append(v1)
+        out[n] = v1
+        n += 1
         i1 += 1
-    return np.array(out, dtype = np.uint32)
+    # whatever is left in either SDR
+    while i1 < n1.size:
+        out[n] = n1[i1]
+        n += 1
+        i1 += 1
+    while i2 < n2.size:
+        out[n] = n2[i2]
+        n += 1
+        i2 += 1
+    return out[:n]
 
 
-@numba.njit(fastmath = True)
+@numba.njit(fastmath = True, cache = True)
 def sdr_distance(n1, n2): 
     """
     A metric distance between two SDRs, consistent for various sizes SDRs
@@ -90,18 +124,476 @@ def sdr_distance(n1, n2):
     """
     return 1.0 - 2.0 * sdr_overlap(n1, n2) / (len(n1) + len(n2)) 
 
-@numba.jit
-def random_sdr(sdr_size, sdr_len):
-    out = np.zeros(sdr_len, dtype = np.uint32)
-    r = np.random.randint(0,sdr_size)
-    for i in range(sdr_len):
-        while r in out:
-            r = np.random.randint(0,sdr_size)
+# Packed bits SDRs. The constants are typed uint64 to keep numba's arithmetic unsigned
+_M1  = np.uint64(0x5555555555555555)
+_M2  = np.uint64(0x3333333333333333)
+_M4  = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+_U1, _U2, _U4, _U6, _U56, _U63 = (np.uint64(v) for v in (1, 2, 4, 6, 56, 63))
+
+def bits_words(sdr_size):
+    """
+    how many uint64 words hold sdr_size bits
+    """
+    return (sdr_size + 63) // 64
+
+@numba.njit(cache = True)
+def popcount(x):
+    # LLVM compiles this into a single popcnt instruction where available
+    x = x - ((x >> _U1) & _M1)
+    x = (x & _M2) + ((x >> _U2) & _M2)
+    x = (x + (x >> _U4)) & _M4
+    return (x * _H01) >> _U56
+
+@numba.njit(cache = True)
+def _sdr_to_bits(sdr, bits):
+    bits[:] = 0
+    for b in sdr:
+        b = np.uint64(b)
+        bits[b >> _U6] |= _U1 << (b & _U63)
+
+@numba.njit(cache = True)
+def sdr_to_bits(sdr, sdr_size):
+    """
+    returns the packed bits form of a sparse SDR
+    """
+    bits = np.empty((sdr_size + 63) // 64, dtype = np.uint64)
+    _sdr_to_bits(sdr, bits)
+    return bits
+
+@numba.njit(cache = True)
+def sdrs_to_bits(sdrs, sdr_size):
+    """
+    converts a 2d array of sparse SDRs, one per row, to a (num_sdrs, words) packed array
+    """
+    bits = np.empty((sdrs.shape[0], (sdr_size + 63) // 64), dtype = np.uint64)
+    for i in range(sdrs.shape[0]):
+        _sdr_to_bits(sdrs[i], bits[i])
+    return bits
+
+@numba.njit(cache = True)
+def bits_to_sdr(bits):
+    """
+    returns the sorted sparse SDR of a packed one
+    """
+    count = 0
+    for w in range(bits.size):
+        count += popcount(bits[w])
+    out = np.empty(count, dtype = np.uint32)
+    n = 0
+    for w in range(bits.size):
+        word = bits[w]
+        while word:
+            low = word & (~word + _U1) # lowest ON bit
+            out[n] = w * 64 + int(popcount(low - _U1))
+            n += 1
+            word ^= low
+    return out
+
+def bits_to_sdrs(bits):
+    """
+    returns a list of sparse SDRs, one for each row in a 2d packed array. 
+    If all have the same number of ON bits use np.array() on the result to get a 2d array
+    """
+    return [bits_to_sdr(row) for row in bits]
+
+@numba.njit(cache = True)
+def bits_count(bits):
+    """
+    number of ON bits in each row of a 2d packed array
+    """
+    out = np.zeros(bits.shape[0], dtype = np.int64)
+    for i in range(bits.shape[0]):
+        for w in range(bits.shape[1]):
+            out[i] += popcount(bits[i, w])
+    return out
+
+@numba.njit(fastmath = True, cache = True)
+def bits_overlap(b1, b2):
+    """
+    same as sdr_overlap() for two packed SDRs
+    """
+    out = 0
+    for w in range(b1.size):
+        out += popcount(b1[w] & b2[w])
+    return out
+
+@numba.njit(fastmath = True, cache = True)
+def bits_distance(b1, b2):
+    """
+    same as sdr_distance() for two packed SDRs
+    """
+    total = 0
+    for w in range(b1.size):
+        total += popcount(b1[w]) + popcount(b2[w])
+    return 1.0 - 2.0 * bits_overlap(b1, b2) / total
+
+@numba.njit(cache = True)
+def bits_union(b1, b2):
+    return b1 | b2
+
+@numba.njit(cache = True)
+def bits_intersection(b1, b2):
+    return b1 & b2
+
+@numba.njit(nogil = True, cache = True)
+def bits_unions(query, bits):
+    """
+    union of a packed query SDR with each row of a 2d packed array, as a new 2d array
+    """
+    out = np.empty_like(bits)
+    for i in range(bits.shape[0]):
+        for w in range(bits.shape[1]):
+            out[i, w] = query[w] | bits[i, w]
+    return out
+
+@numba.njit(nogil = True, cache = True)
+def bits_intersections(query, bits):
+    """
+    intersection of a packed query SDR with each row of a 2d packed array, as a new 2d array
+    """
+    out = np.empty_like(bits)
+    for i in range(bits.shape[0]):
+        for w in range(bits.shape[1]):
+            out[i, w] = query[w] & bits[i, w]
+    return out
+
+@numba.njit(fastmath = True, nogil = True, cache = True)
+def bits_overlaps(query, bits):
+    """
+    overlaps of a packed query SDR with each row of a 2d packed array
+    """
+    out = np.empty(bits.shape[0], dtype = np.int64)
+    for i in range(bits.shape[0]):
+        out[i] = bits_overlap(query, bits[i])
+    return out
+
+@numba.njit(fastmath = True, nogil = True, cache = True)
+def bits_distances(query, bits):
+    """
+    sdr_distance()-s of a packed query SDR from each row of a 2d packed array
+    """
+    counts = bits_count(bits)
+    qcount = 0
+    for w in range(query.size):
+        qcount += popcount(query[w])
+    out = np.empty(bits.shape[0], dtype = np.float64)
+    for i in range(bits.shape[0]):
+        out[i] = 1.0 - 2.0 * bits_overlap(query, bits[i]) / (qcount + counts[i])
+    return out
+
+@numba.njit(nogil = True, cache = True)
+def _heap_sift(values, ids, pos):
+    # restores min-heap order below pos, on equal values the later id is evicted first
+    size = values.size
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and (values[child + 1] < values[child] or 
+                (values[child + 1] == values[child] and ids[child + 1] > ids[child])):
+            child += 1
+        if values[pos] < values[child] or (values[pos] == values[child] and ids[pos] > ids[child]):
+            break
+        values[pos], values[child] = values[child], values[pos]
+        ids[pos], ids[child] = ids[child], ids[pos]
+        pos = child
+
+@numba.njit(nogil = True, cache = True)
+def _heap_offer(values, ids, value, idx):
+    # keeps the k best (value, lowest id) pairs, values[0] is the worst of them
+    if value > values[0] or (value == values[0] and idx < ids[0]):
+        values[0] = value
+        ids[0] = idx
+        _heap_sift(values, ids, 0)
+
+@numba.njit(nogil = True, cache = True)
+def _bit_test_overlap(sdr, bits):
+    # overlap of a sparse SDR with a packed one, cheaper than popcounts for short SDRs
+    out = 0
+    for b in sdr:
+        b = np.uint64(b)
+        out += (bits[b >> _U6] >> (b & _U63)) & _U1
+    return out
+
+@numba.njit(parallel = True, nogil = True, cache = True)
+def _knn_tiles(queries, qcounts, sparse_queries, database, dcounts, distance, tile, values, ids):
+    """
+    scans database in tiles of rows small enough to stay cached while all queries 
+    run against them in parallel. Each query keeps its own heap in values/ids rows
+    """
+    for start in range(0, database.shape[0], tile):
+        end = min(start + tile, database.shape[0])
+        for q in numba.prange(queries.shape[0]):
+            qvalues, qids = values[q], ids[q]
+            for d in range(start, end):
+                if sparse_queries:
+                    ov = _bit_test_overlap(queries[q], database[d])
+                else:
+                    ov = bits_overlap(queries[q], database[d])
+                if distance:
+                    total = qcounts[q] + dcounts[d]
+                    value = 2.0 * ov / total if total else 0.0 # 1 - sdr_distance()
+                else:
+                    value = float(ov)
+                _heap_offer(qvalues, qids, value, d)
+
+# a random bit test costs about as much as popcounts of this many sequential words (measured)
+BIT_TEST_WORDS = 3
+
+def knn_search(queries, database, k = 10, metric = "overlap", sdr_size = None, tile_bytes = 1 << 20, bit_tests = None):
+    """
+    exact k nearest neighbours of each query in database, by brute force. 
+    
+    queries, database: 2d arrays of either sparse SDRs (one sorted SDR per row) 
+                       or packed SDRs (uint64 rows, see sdrs_to_bits()).
+    metric: "overlap" (higher is closer) or "distance" (sdr_distance(), lower is closer)
+    sdr_size: for sparse inputs, defaults to highest bit + 1
+    tile_bytes: how much of the (packed) database is scanned at once, should fit in cache
+    bit_tests: for sparse queries, True matches them against packed rows by testing their bits,
+               False packs them and uses popcounts. By default bit tests are used when their 
+               cost (ON bits * BIT_TEST_WORDS) is below the popcounts' (words per packed row)
+
+    The (queries x database) matrix is never materialized: each query keeps a k sized heap
+    while the database is scanned in tiles.
+
+    returns ids (num_queries, k) of database rows, closest first and their overlaps or distances
+    """
+    assert metric in ("overlap", "distance")
+    if database.dtype != np.uint64:
+        if queries.dtype == np.uint64:
+            sdr_size = queries.shape[1] * 64
+        elif sdr_size is None:
+            sdr_size = int(max(database.max(), queries.max())) + 1
+        database = sdrs_to_bits(database, sdr_size)
+    dcounts = bits_count(database)
+    if queries.dtype == np.uint64:
+        qcounts = bits_count(queries)
+        sparse_queries = False
+    else:
+        qcounts = np.full(queries.shape[0], queries.shape[1], dtype = np.int64)
+        on_bits, words = queries.shape[1], database.shape[1]
+        sparse_queries = on_bits * BIT_TEST_WORDS < words if bit_tests is None else bool(bit_tests)
+        if not sparse_queries:
+            queries = sdrs_to_bits(queries, database.shape[1] * 64)
+
+    k = min(k, database.shape[0])
+    values = np.full((queries.shape[0], k), -1.0)
+    ids = np.full((queries.shape[0], k), database.shape[0], dtype = np.int64)
+    tile = max(64, tile_bytes // database[0].nbytes)
+    _knn_tiles(queries, qcounts, sparse_queries, database, dcounts, metric == "distance", tile, values, ids)
+
+    return _best_first(values, ids, metric)
+
+def _best_first(values, ids, metric):
+    # sorts k sized heaps to best first order, ties by lower id
+    rank = np.lexsort((ids, -values), axis = -1)
+    ids = np.take_along_axis(ids, rank, axis = 1)
+    values = np.take_along_axis(values, rank, axis = 1)
+    if metric == "distance":
+        return ids, 1.0 - values
+    return ids, values.astype(np.int64)
+
+@numba.njit(nogil = True, cache = True)
+def _postings_merge(offsets, postings, sdrs, first_id, new_offsets, new_postings):
+    """
+    builds new CSR arrays: each bit's old posting list followed by the ids of new sdrs having that bit
+    """
+    fill = new_offsets[:-1].copy()
+    for b in range(offsets.size - 1):
+        n = offsets[b + 1] - offsets[b]
+        new_postings[fill[b]:fill[b] + n] = postings[offsets[b]:offsets[b + 1]]
+        fill[b] += n
+    for i in range(sdrs.shape[0]):
+        for b in sdrs[i]:
+            new_postings[fill[b]] = first_id + i
+            fill[b] += 1
+
+@numba.njit(parallel = True, nogil = True, cache = True)
+def _index_query(queries, offsets, postings, lengths, distance, values, ids, nblocks):
+    """
+    counts overlaps walking only the posting lists of each query's bits, 
+    then offers the touched items to the query's k heap. 
+    Each thread block reuses one counts array, reset through its touched list
+    """
+    bsize = (queries.shape[0] + nblocks - 1) // nblocks
+    for blk in numba.prange(nblocks):
+        counts = np.zeros(lengths.size, dtype = np.int32)
+        touched = np.empty(lengths.size, dtype = np.int64)
+        for q in range(blk * bsize, min((blk + 1) * bsize, queries.shape[0])):
+            ntouched = 0
+            for b in queries[q]:
+                for p in range(offsets[b], offsets[b + 1]):
+                    item = postings[p]
+                    if counts[item] == 0:
+                        touched[ntouched] = item
+                        ntouched += 1
+                    counts[item] += 1
+            for t in range(ntouched):
+                item = touched[t]
+                ov = counts[item]
+                counts[item] = 0
+                if distance:
+                    value = 2.0 * ov / (queries.shape[1] + lengths[item])
+                else:
+                    value = float(ov)
+                _heap_offer(values[q], ids[q], value, item)
+
+class SDRIndex:
+    """
+    Inverted bit index for exact top-k overlap search. 
+
+    For each bit it keeps the posting list of ids of stored SDRs having that bit ON, 
+    as compact CSR arrays (offsets, postings). A query only walks the lists of its own bits, 
+    so its cost is proportional to the number of candidates sharing bits with it, 
+    not to the size of the index.
+
+    Ids are row numbers in the order SDRs were append()-ed
+    """
+    def __init__(self, sdr_size):
+        self.sdr_size = sdr_size
+        self.offsets = np.zeros(sdr_size + 1, dtype = np.int64)
+        self.postings = np.zeros(0, dtype = np.uint32)
+        self.lengths = np.zeros(0, dtype = np.int64)
+
+    def __len__(self):
+        return self.lengths.size
+
+    def append(self, sdrs):
+        """
+        adds a 2d array of sparse SDRs, one per row. 
+        Rebuilding the CSR arrays costs O(index size), so append in batches rather than one at a time
+        returns the ids of appended sdrs
+        """
+        first_id = len(self)
+        bit_counts = np.bincount(sdrs.ravel(), minlength = self.sdr_size)
+        new_offsets = self.offsets.copy()
+        new_offsets[1:] += np.cumsum(bit_counts)
+        new_postings = np.empty(new_offsets[-1], dtype = np.uint32)
+        _postings_merge(self.offsets, self.postings, sdrs, first_id, new_offsets, new_postings)
+        self.offsets, self.postings = new_offsets, new_postings
+        self.lengths = np.concatenate((self.lengths, np.full(sdrs.shape[0], sdrs.shape[1], dtype = np.int64)))
+        return np.arange(first_id, len(self))
+
+    def query(self, queries, k = 10, metric = "overlap"):
+        """
+        exact top k stored SDRs for each row in queries, by overlap or sdr_distance (see knn_search())
+        Only stored SDRs sharing at least one bit with a query are candidates, 
+        missing results have id -1.
+        returns ids (num_queries, k), closest first and their overlaps or distances
+        """
+        assert metric in ("overlap", "distance")
+        values = np.full((queries.shape[0], k), -1.0)
+        ids = np.full((queries.shape[0], k), -1, dtype = np.int64)
+        _index_query(queries, self.offsets, self.postings, self.lengths, metric == "distance", values, ids,
+                     numba.get_num_threads())
+        return _best_first(values, ids, metric)
+
+# Batched generators. Each row gets its own splitmix64 random stream, seeded from (seed, row), 
+# so results do not depend on how rows are split between threads.
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1   = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2   = np.uint64(0x94D049BB133111EB)
+_U27, _U30, _U31, _U32 = (np.uint64(v) for v in (27, 30, 31, 32))
+
+@numba.njit(cache = True)
+def _splitmix(state):
+    # returns the next state and a random uint64
+    state += _GOLDEN
+    z = state
+    z = (z ^ (z >> _U30)) * _MIX1
+    z = (z ^ (z >> _U27)) * _MIX2
+    return state, z ^ (z >> _U31)
+
+@numba.njit(cache = True)
+def _randint(state, n):
+    # returns the next state and a random int in 0..n-1
+    state, r = _splitmix(state)
+    return state, int(r % np.uint64(n))
+
+@numba.njit(cache = True)
+def _stream(seed, row):
+    # initial state of row's random stream
+    state, r = _splitmix((np.uint64(seed) << _U32) ^ np.uint64(row))
+    return r
+
+@numba.njit(nogil = True, cache = True)
+def _random_row(state, sdr_size, out, used):
+    """
+    fills out with distinct random bits, sorted. 
+    used is a sdr_size bitmap, all False, replacing the slow "while r in out" check
+    """
+    for i in range(out.size):
+        state, r = _randint(state, sdr_size)
+        while used[r]:
+            state, r = _randint(state, sdr_size)
+        used[r] = True
+        out[i] = r
+    for r in out:
+        used[r] = False
+    out.sort()
+    return state
+
+@numba.njit(nogil = True, cache = True)
+def _near_row(state, sdr, sdr_size, switch, out, used):
+    """
+    same as near_sdr(): out is sdr with switch random bits replaced by bits not in sdr
+    """
+    out[:] = sdr
+    for r in sdr:
+        used[r] = True
+    for i in range(switch): # partial shuffle picks which bits are replaced
+        state, j = _randint(state, out.size - i)
+        j += i
+        out[i], out[j] = out[j], out[i]
+    for i in range(switch):
+        state, r = _randint(state, sdr_size)
+        while used[r]:
+            state, r = _randint(state, sdr_size)
+        used[r] = True
         out[i] = r
+    for r in sdr:
+        used[r] = False
+    for i in range(switch):
+        used[out[i]] = False
     out.sort()
+    return state
+
+@numba.njit(parallel = True, nogil = True, cache = True)
+def _random_batch(seed, sdr_size, out, nblocks):
+    bsize = (out.shape[0] + nblocks - 1) // nblocks
+    for blk in numba.prange(nblocks):
+        used = np.zeros(sdr_size, dtype = np.bool_)
+        for i in range(blk * bsize, min((blk + 1) * bsize, out.shape[0])):
+            _random_row(_stream(seed, i), sdr_size, out[i], used)
+
+@numba.njit(parallel = True, nogil = True, cache = True)
+def _near_batch(seed, sdrs, sdr_size, switch, out, nblocks):
+    bsize = (out.shape[0] + nblocks - 1) // nblocks
+    for blk in numba.prange(nblocks):
+        used = np.zeros(sdr_size, dtype = np.bool_)
+        for i in range(blk * bsize, min((blk + 1) * bsize, out.shape[0])):
+            _near_row(_stream(seed, i), sdrs[i], sdr_size, switch, out[i], used)
+
+@numba.njit(nogil = True, cache = True)
+def _near_chain(seed, sdr_size, switch, out):
+    # a chain is sequential by nature, row i+1 is derived from row i
+    used = np.zeros(sdr_size, dtype = np.bool_)
+    state = _random_row(_stream(seed, 0), sdr_size, out[0], used)
+    for i in range(1, out.shape[0]):
+        state = _near_row(state, out[i-1], sdr_size, switch, out[i], used)
+
+@numba.njit(cache = True)
+def random_sdr(sdr_size, sdr_len):
+    """
+    a random sorted SDR, seeded from numba's np.random state
+    """
+    out = np.empty(sdr_len, dtype = np.uint32)
+    used = np.zeros(sdr_size, dtype = np.bool_)
+    _random_row(_stream(np.random.randint(0, 2**31), 0), sdr_size, out, used)
     return out
-    
-@numba.jit
+
+@numba.njit(cache = True)
 def near_sdr(sdr, sdr_size, switch = 3):
     """
     returns a sdr close to input sdr by switching switch bits
@@ -111,43 +603,60 @@ def near_sdr(sdr, sdr_size, switch = 3):
     sdr_size: total number of available bits
     switch: how many bits in input SDR will be changed.
     """
-    out = sdr.copy() 
-    np.random.shuffle(out) 
-    for i in range(switch): 
-        x = np.random.randint(0,sdr_size)
-        while x in out:
-            x = np.random.randint(0,sdr_size)
-        out[i] = x
-    out.sort()
+    out = np.empty_like(sdr)
+    used = np.zeros(sdr_size, dtype = np.bool_)
+    _near_row(_stream(np.random.randint(0, 2**31), 0), sdr, sdr_size, switch, out, used)
     return out
 
-def near_sdrs(num_sdrs, sdr_size, on_bits, switch = 3):
+def _seed(seed):
+    # without an explicit seed, draw one from numpy's global generator, so np.random.seed() still applies
+    return np.random.randint(0, 2**31) if seed is None else seed
+
+def random_sdr_batch(num_sdrs, sdr_size, on_bits, seed = None):
     """
-    generates a list of slowly, randomly changing SDRs 
+    generates a (num_sdrs, on_bits) uint32 array of independent random sorted SDRs, in parallel.
+    Same seed gives same SDRs regardless of number of threads.
+    """
+    out = np.empty((num_sdrs, on_bits), dtype = np.uint32)
+    _random_batch(_seed(seed), sdr_size, out, numba.get_num_threads())
+    return out
+
+def near_sdr_batch(sdrs, sdr_size, switch = 3, seed = None):
+    """
+    near_sdr() for each row of a 2d array of sdrs, in parallel. 
+    returns a new array of same shape
+    """
+    out = np.empty_like(sdrs)
+    _near_batch(_seed(seed), sdrs, sdr_size, switch, out, numba.get_num_threads())
+    return out
+
+def near_sdrs(num_sdrs, sdr_size, on_bits, switch = 3, seed = None):
+    """
+    generates an array of slowly, randomly changing SDRs, one per row
     first SDR is generated randomly
     each following SDR is produced by randomly changing switch bits in its previous
 
-    num_sdrs: how many SDRs to generate
+    num_sdrs: how many SDRs to generate (after the first one)
     sdr_size: SDR length
     on_bits : Solidity
     switch  : how many bits to switch from previous SDR in the list
+    seed    : for reproducible results
     """
-    tor = [ np.random.permutation(sdr_size).astype(np.uint32)[:on_bits] ]
-    tor[0].sort()
-    for _ in range(num_sdrs):
-        tor.append(near_sdr(tor[-1],sdr_size, switch))
-    return tor
+    out = np.empty((num_sdrs + 1, on_bits), dtype = np.uint32)
+    _near_chain(_seed(seed), sdr_size, switch, out)
+    return out
 
-def random_sdrs(num_sdrs, sdr_size, on_bits): 
+def random_sdrs(num_sdrs, sdr_size, on_bits, seed = None): 
     """
-    produces a list of random SDRs
+    produces an array of random SDRs, two consecutive ones have zero overlap.
+    Use random_sdr_batch() if independent SDRs are good enough, it runs in parallel.
 
     num_sdrs: how many SDRs to generate
     sdr_size: SDR length
     on_bits : Solidity
     
     """
-    return near_sdrs(num_sdrs, sdr_size, on_bits, on_bits)[1:]
+    return near_sdrs(num_sdrs, sdr_size, on_bits, on_bits, seed)[1:]
 
 
 
@@ -158,16 +667,67 @@ if __name__ == "__main__":
     SDR_SIZE =   20000
     SDR_BITS =      40
 
-    dummy = near_sdrs(2, SDR_SIZE, SDR_BITS) # give numba time to compile
-
     print(f"generating {NUM_SDRS} sdrs of solidity/size: {SDR_BITS}/{SDR_SIZE}")
     print("Near  ....")
     t = time()
     nsdrs = near_sdrs(NUM_SDRS, SDR_SIZE, SDR_BITS) 
     t = time() - t
     print(f"{NUM_SDRS} sdrs generated in {int(t*1000)} ms")
+
     print("Random ....")
     t = time()
     rsdrs = random_sdrs(NUM_SDRS, SDR_SIZE, SDR_BITS)
     t = time() - t
     print(f"{NUM_SDRS} sdrs generated in {int(t*1000)} ms")
+    print("Random batch ....")
+    random_sdr_batch(2, SDR_SIZE, SDR_BITS) # compile
+    near_sdr_batch(rsdrs[:2], SDR_SIZE)
+    t = time()
+    bsdrs = random_sdr_batch(NUM_SDRS, SDR_SIZE, SDR_BITS, seed = 1)
+    t = time() - t
+    print(f"{NUM_SDRS} independent sdrs generated in {int(t*1000)} ms, reproducible: "
+          f"{(bsdrs[-10:] == random_sdr_batch(NUM_SDRS, SDR_SIZE, SDR_BITS, seed = 1)[-10:]).all()}")
+    t = time()
+    bsdrs = near_sdr_batch(bsdrs, SDR_SIZE, seed = 2)
+    t = time() - t
+    print(f"{NUM_SDRS} near sdrs generated in {int(t*1000)} ms")
+
+    print("Sparse vs packed bits overlap ....")
+    rsdrs = np.array(rsdrs[:100001])
+    bits = sdrs_to_bits(rsdrs[:2], SDR_SIZE)  # compile
+    t = time()
+    bits = sdrs_to_bits(rsdrs, SDR_SIZE)
+    t = time() - t
+    print(f"{len(rsdrs)} sdrs packed in {int(t*1000)} ms")
+    sdr_overlap(rsdrs[0], rsdrs[1])
+    t = time()
+    for sdr in rsdrs[1:]:
+        sdr_overlap(rsdrs[0], sdr)
+    t = time() - t
+    print(f"{len(rsdrs) - 1} sparse overlaps in {int(t*1000)} ms (python loop)")
+    bits_overlaps(bits[0], bits[:2])
+    t = time()
+    overlaps = bits_overlaps(bits[0], bits[1:])
+    t = time() - t
+    print(f"{len(rsdrs) - 1} packed overlaps in {int(t*1000)} ms, {bits.shape[1]} words per sdr")
+
+    print("Exact knn ....")
+    queries = np.array([near_sdr(sdr, SDR_SIZE, SDR_BITS // 4) for sdr in rsdrs[:1000]])
+    knn_search(queries[:2], rsdrs[:10], k = 2) # compile
+    t = time()
+    ids, overlaps = knn_search(queries, rsdrs, k = 10)
+    t = time() - t
+    found = (ids[:,0] == np.arange(len(queries))).mean()
+    print(f"top 10 of {len(queries)} queries in {len(rsdrs)} sdrs found in {int(t*1000)} ms, {found*100:.1f}% closest are the originals")
+
+    index = SDRIndex(SDR_SIZE)
+    t = time()
+    index.append(rsdrs)
+    t = time() - t
+    print(f"{len(index)} sdrs indexed in {int(t*1000)} ms")
+    index.query(queries[:2], k = 2) # compile
+    t = time()
+    iids, ioverlaps = index.query(queries, k = 10)
+    t = time() - t
+    print(f"top 10 of {len(queries)} queries found with the inverted index in {int(t*1000)} ms, "
+          f"same as brute force: {(ioverlaps == overlaps).all()}")
@@ -19,6 +19,13 @@ between all pairs of bits within a *SDR space*
 
 In score() mode a value map can be seen like a key->scalar dictionary where keys are SDRs and values are simple scalars
 
+With decay specified old correlations fade in time (see ValueCorrMap.tick()), 
+useful for non stationary data. Decay is lazy, its cost is proportional with the SDR's pairs not with map size.
+
+With order = 3 the map correlates bit triples instead of pairs, folded into a fixed memory budget.
+A sampled subset of triples can be used to bound the cost of larger SDRs. 
+Run this module to compare pairs vs triples throughput.
+
 ====================================================================================
 
 @Copyright 2022 Cezar Totth 
@@ -28,7 +35,14 @@ Use it as you like
 
 import numpy as np
 import numba
+import sdr_metrics as metrics
+
+_METRICS = metrics.ENABLED   # probes are compiled out unless SDR_METRICS is set
+
+STAMP_MASK = 0xFFFFFFFF      # stamps are uint32, epochs wrap around and ages are taken modulo 2**32
 
+# generators are not cached on disk: numba can't reload a cached generator consumer
+# compiled for other argument types, so addr2 / addr3 and the query generators compile per process
 @numba.njit
 def addr2(sdr):
     # Projects sdr into a plane
@@ -37,35 +51,64 @@ def addr2(sdr):
         for y in range(x):
             yield (x,y), xv + sdr[y]
 
-@numba.njit
-def _value_add2(sdr, value_map, value): 
+@numba.njit(cache = True)
+def _cell(value_map, stamps, addr, epoch, decay):
+    """
+    returns value_map[addr]. 
+    On a decaying map (non empty stamps) the decay accumulated since the cell was 
+    last touched is applied first, so the cell is brought up to date with epoch.
+    Ages are modulo 2**32, a cell untouched for 2**32 ticks is off, by then decay ** age is ~0 anyway
+    """
+    if stamps.size:
+        age = (epoch - stamps[addr]) & STAMP_MASK
+        if age:
+            value_map[addr] *= decay ** age
+            stamps[addr] = epoch
+    return value_map[addr]
+
+@numba.njit(cache = True)
+def _value_add2(sdr, value_map, value, stamps, epoch, decay): 
     """
     increments value_map by value at sdr's 2d address points
+    Same points as addr2(), loops are spelled out since numba generators are slow in hot loops
     """
     msize = value_map.shape[0]
     num_points = 0
-    for xy, addr in addr2(sdr):
-        value_map[addr % msize] += value
-        num_points += 1
+    decaying = stamps.size > 0
+    for x in range(1,sdr.size):
+        xv = sdr[x]*(sdr[x] - 1) // 2
+        for y in range(x):
+            addr = (xv + sdr[y]) % msize
+            if decaying:
+                _cell(value_map, stamps, addr, epoch, decay)
+            value_map[addr] += value
+            num_points += 1
     return num_points
 
 @numba.njit
-def _value_query2(sdr, value_map): 
+def _value_query2(sdr, value_map, stamps, epoch, decay): 
     msize = value_map.shape[0]
     for xy, addr in addr2(sdr):
-        yield xy, value_map[addr % msize]
+        yield xy, _cell(value_map, stamps, addr % msize, epoch, decay)
 
-@numba.njit
-def _value_score2(sdr, value_map): 
+@numba.njit(cache = True)
+def _value_score2(sdr, value_map, stamps, epoch, decay): 
+    msize = value_map.shape[0]
     num_points = 0
-    vsum = 0
-    for xy, value in _value_query2(sdr, value_map):
-        num_points += 1
-        vsum += value
+    vsum = 0.0
+    decaying = stamps.size > 0
+    for x in range(1,sdr.size):
+        xv = sdr[x]*(sdr[x] - 1) // 2
+        for y in range(x):
+            addr = (xv + sdr[y]) % msize
+            if decaying:
+                _cell(value_map, stamps, addr, epoch, decay)
+            num_points += 1
+            vsum += value_map[addr]
     return vsum / num_points
 
 class ValueCorrMap:
-    def __init__(self, sdr_size = None, mem_size = None):
+    def __init__(self, sdr_size = None, mem_size = None, decay = None, order = 2, sample = 1.0):
         """
         at least one of sdr_size or mem_size should be specified
 
@@ -79,43 +122,228 @@ class ValueCorrMap:
             if sdr_size is not specified, 
                 the memory map is created such its size in bytes matches this value
 
+        decay input: 
+            if specified (e.g. 0.999) values in map fade by this factor on every tick(), 
+            each add() is also a tick. 
+            The map is never swept, instead each cell keeps the epoch it was last touched
+            and the decay is applied lazily to the cells add/score/query actually read. 
+            Values become float32 and the per cell stamps double the bytes per cell.
+
+        order input: 
+            2 (default) correlates bit pairs, 3 correlates bit triples (see addr3()).
+            The canonical size of a triples map is sdr_size**3/6 which is infeasible
+            for all but tiny SDRs, so triple addresses are folded modulo the memory size,
+            use mem_size to set the memory budget. Without mem_size the map holds the
+            sampled triples, at most TRIPLES_DEFAULT_CELLS (as many as a 2048 bit pairs map).
+
+        sample input:
+            only for order 3, the fraction of triples used for each SDR. 
+            A SDR with n bits has n*(n-1)*(n-2)/6 triples, sampling bounds that cost.
+            Sampling is deterministic, a given triple is either always used or never.
         """
+        assert order in (2, 3)
+        assert 0.0 < sample <= 1.0
+        keep = min(int(sample * SAMPLE_ONE), SAMPLE_ONE)
+        cell_bytes = 4 if decay is None else 8
         if sdr_size is None:
             assert mem_size is not None
-            mem_size = mem_size // 4
+            mem_size = mem_size // cell_bytes
         elif mem_size is None:
             assert sdr_size is not None
-            mem_size = sdr_size * (sdr_size - 1)//2
+            mem_size = self.canonical_size(sdr_size, order)
+            if order == 3:
+                mem_size = min(mem_size * keep // SAMPLE_ONE, TRIPLES_DEFAULT_CELLS)
         else:
-            sz1 = mem_size // 4
-            sz2 = sdr_size * (sdr_size - 1) // 2
+            sz1 = mem_size // cell_bytes
+            sz2 = self.canonical_size(sdr_size, order)
             mem_size = min(sz1, sz2)
 
-        self.vmap = np.zeros(mem_size, dtype = np.int32)
+        self.order = order
+        self.keep = keep
+
+        self.decay = 1.0 if decay is None else float(decay)
+        self.epoch = 0
+        if decay is None:
+            self.vmap = np.zeros(mem_size, dtype = np.int32)
+            self.stamps = np.zeros(0, dtype = np.uint32)
+        else:
+            assert 0.0 < self.decay <= 1.0
+            self.vmap = np.zeros(mem_size, dtype = np.float32)
+            self.stamps = np.zeros(mem_size, dtype = np.uint32)
         self.totals = 0
+        self.writes = 0     # bumped by every add and tick, invalidates cached scores
+
+    @staticmethod
+    def canonical_size(sdr_size, order = 2):
+        """
+        number of bit pairs (or triples for order 3) in a sdr_size space
+        """
+        if order == 3:
+            return sdr_size * (sdr_size - 1) * (sdr_size - 2) // 6
+        return sdr_size * (sdr_size - 1) // 2
 
     def score(self, sdr):
-        return _value_score2(sdr, self.vmap)
+        if _METRICS: t = metrics.clock()
+        if self.order == 3:
+            score = _value_score3(sdr, self.vmap, self.stamps, self.epoch, self.decay, self.keep)
+        else:
+            score = _value_score2(sdr, self.vmap, self.stamps, self.epoch, self.decay)
+        if _METRICS: self._record("score", t, 1, len(sdr))
+        return score
 
     def add(self, sdr, value = 1):
         """
         Increments value map with specified value on all sdr's bit pairs.
         returns the total value added and sum of all values into the map.
         """
-        plus = _value_add2(sdr, self.vmap, value)
+        if _METRICS: t = metrics.clock()
+        self.tick()
+        self.writes += 1
+        if self.order == 3:
+            plus = _value_add3(sdr, self.vmap, value, self.stamps, self.epoch, self.decay, self.keep)
+        else:
+            plus = _value_add2(sdr, self.vmap, value, self.stamps, self.epoch, self.decay)
+        if _METRICS: self._record("add", t, 1, len(sdr))
+        plus *= value
         self.totals += plus
         return plus, self.totals
 
+    def add_many(self, sdrs, values = 1):
+        """
+        Batched add(), sdrs is a 2d array with one sdr per row. 
+        values is either a scalar or an array with a value for each row.
+        returns the total value added for each row and sum of all values into the map.
+        """
+        if _METRICS: t = metrics.clock()
+        values = np.broadcast_to(np.asarray(values, dtype = self.vmap.dtype), (len(sdrs),))
+        self.writes += 1
+        plus = _value_add_many(sdrs, self.vmap, values, self.stamps, self.epoch, self.decay, self.order, self.keep)
+        if _METRICS: self._record("add_many", t, len(sdrs), sdrs.shape[1])
+        plus = plus * values
+        if self.stamps.size:
+            ages = np.arange(len(sdrs) - 1, -1, -1)
+            self.tick(len(sdrs))
+            self.totals += (plus * self.decay ** ages).sum()
+        else:
+            self.totals += plus.sum()
+        return plus, self.totals
+
+    def score_many(self, sdrs):
+        """
+        Batched score(), returns an array with the score for each row in sdrs
+        """
+        if _METRICS: t = metrics.clock()
+        scores = _value_score_many(sdrs, self.vmap, self.stamps, self.epoch, self.decay, self.order, self.keep)
+        if _METRICS: self._record("score_many", t, len(sdrs), sdrs.shape[1])
+        return scores
+
+    def _record(self, op, t, num_sdrs, sdr_len):
+        # pairs (triples) are expanded and read in one compiled call, timed as a single phase
+        metrics.phase(f"valuemap.{op}.kernel", t)
+        metrics.observe(f"valuemap.{op}.pairs", self._points(num_sdrs, sdr_len))
+        metrics.count(f"valuemap.{op}.calls")
+
+    def _points(self, num_sdrs, sdr_len):
+        # pairs, or (expected, when sampled) triples expanded from num_sdrs SDRs
+        points = num_sdrs * self.max_points(sdr_len)
+        if self.order == 3:
+            points = points * self.keep // SAMPLE_ONE
+        return points
+
+    def tick(self, steps = 1):
+        """
+        advances time on a decaying map, all values fade by decay ** steps. 
+        It costs nothing, the cells are updated only when touched. 
+        Since all cells fade alike, totals is decayed exactly here.
+        """
+        if self.stamps.size:
+            self.writes += 1
+            self.epoch = (self.epoch + steps) & STAMP_MASK
+            self.totals *= self.decay ** steps
+
     def query(self, sdr):
         """
         returns an iterator over individual values for each bit pair in sdr. 
         The results can be used to highlight bit pairs with unusual values.
         each step yields a tuple consisting of bit pairs and corresponding values
+        (bit triples for order 3 maps)
+        """
+        if _METRICS:
+            # the generator runs as the caller iterates, so only calls and pairs are recorded
+            metrics.observe("valuemap.query.pairs", self._points(1, len(sdr)))
+            metrics.count("valuemap.query.calls")
+        if self.order == 3:
+            return _value_query3(sdr, self.vmap, self.stamps, self.epoch, self.decay, self.keep)
+        return _value_query2(sdr, self.vmap, self.stamps, self.epoch, self.decay)
+
+    def max_points(self, sdr_len):
+        """
+        how many bit pairs (or triples) a sdr_len long SDR can expand to
+        """
+        return self.canonical_size(sdr_len, self.order)
+
+    def query_arrays(self, sdr, points = None, values = None):
         """
-        return _value_query2(sdr, self.vmap)
+        like query() but fills arrays instead of yielding one tuple at a time. 
+        points - (max_points, order) array receiving positions within sdr of each bit pair/triple
+        values - (max_points,) array receiving corresponding map values
+        Both are allocated when not provided, preallocate them to avoid allocations in loops.
+
+        returns points and values views trimmed to the actual number of points
+        """
+        size = self.max_points(len(sdr))
+        if points is None:
+            points = np.zeros((size, self.order), dtype = np.int32)
+        if values is None:
+            values = np.zeros(size, dtype = np.float64)
+        # the kernel doesn't check bounds, a short buffer would be silently overrun
+        if points.dtype != np.int32 or points.ndim != 2 or points.shape[0] < size or points.shape[1] != self.order:
+            raise ValueError(f"points must be an int32 array of at least ({size}, {self.order}), got {points.dtype} {points.shape}")
+        if values.dtype != np.float64 or values.ndim != 1 or values.shape[0] < size:
+            raise ValueError(f"values must be a float64 array of at least ({size},), got {values.dtype} {values.shape}")
+        if _METRICS: t = metrics.clock()
+        count = _value_query_into(sdr, self.vmap, self.stamps, self.epoch, self.decay, self.order, self.keep, 
+                                  points, values)
+        if _METRICS: self._record("query_arrays", t, 1, len(sdr))
+        return points[:count], values[:count]
+
+    def query_many(self, sdrs):
+        """
+        Batched query_arrays() for a 2d array of sdrs, one per row. 
+        returns:
+            points - (num_sdrs, max_points, order) positions within each sdr 
+            values - (num_sdrs, max_points) corresponding map values
+            counts - (num_sdrs,) number of valid points in each row. 
+                     With order 2 all rows are full, sampled triples leave unused tails
+        """
+        size = self.max_points(sdrs.shape[1])
+        points = np.zeros((len(sdrs), size, self.order), dtype = np.int32)
+        values = np.zeros((len(sdrs), size), dtype = np.float64)
+        if _METRICS: t = metrics.clock()
+        counts = _value_query_many(sdrs, self.vmap, self.stamps, self.epoch, self.decay, self.order, self.keep, 
+                                   points, values)
+        if _METRICS: self._record("query_many", t, len(sdrs), sdrs.shape[1])
+        return points, values, counts
+
+    def anomalous(self, sdr, m = 8, mean = None):
+        """
+        returns points and values for the m bit pairs (or triples) in sdr 
+        whose values are furthest away from the map's mean(), most unusual first. 
+        Use mean to compare against another reference value
+        """
+        if mean is None:
+            mean = self.mean()
+        size = self.max_points(len(sdr))
+        points = np.zeros((size, self.order), dtype = np.int32)
+        values = np.zeros(size, dtype = np.float64)
+        if _METRICS: t = metrics.clock()
+        count = _value_anomalous(sdr, self.vmap, self.stamps, self.epoch, self.decay, self.order, self.keep, 
+                                 points, values, m, mean)
+        if _METRICS: self._record("anomalous", t, 1, len(sdr))
+        return points[:count], values[:count]
 
     def mem_size(self):
-        return self.vmap.size * 4
+        return self.vmap.nbytes + self.stamps.nbytes
 
     def mean(self): 
         """
@@ -126,7 +354,7 @@ class ValueCorrMap:
 
 @numba.njit
 def addr3(sdr):
-    # Projects sdr into a cube. Not used yet, a 3bit map was the original idea
+    # Projects sdr into a cube, used by order = 3 maps
     for x in range(2,sdr.size): 
         sx = sdr[x]
         xv = sx * (sx-1) * (sx-2) // 6
@@ -136,6 +364,175 @@ def addr3(sdr):
             for z in range(y):
                 yield xv + yv + sdr[z], (x,y,z)
 
+SAMPLE_ONE = 1 << 16 # keep value for which all triples are used
+TRIPLES_DEFAULT_CELLS = 2048 * 2047 // 2    # order 3 map size when only sdr_size is given
+
+@numba.njit(cache = True)
+def _kept(addr, keep):
+    # deterministic pseudo random choice of roughly keep/SAMPLE_ONE of all addresses
+    return keep >= SAMPLE_ONE or ((addr * 0x5851F42D4C957F2D) >> 32) & 0xFFFF < keep
+
+@numba.njit
+def addr3_sampled(sdr, keep):
+    """
+    like addr3 but yields only a deterministic subset of triples, roughly keep/SAMPLE_ONE of them.
+    A triple is kept or dropped depending on its two highest bits, 
+    so different SDRs sharing a triple agree on it, and the triples of a dropped 
+    bit pair are not even enumerated.
+    """
+    for x in range(2,sdr.size): 
+        sx = sdr[x]
+        xv = sx * (sx-1) * (sx-2) // 6
+        for y in range(1,x):
+            sy = sdr[y]
+            yv = xv + sy * (sy-1) // 2 
+            if not _kept(yv, keep):
+                continue
+            for z in range(y):
+                yield (x,y,z), yv + sdr[z]
+
+@numba.njit(cache = True)
+def _value_add3(sdr, value_map, value, stamps, epoch, decay, keep): 
+    """
+    increments value_map by value at sdr's (sampled) 3d address points
+    Same points as addr3_sampled()
+    """
+    msize = value_map.shape[0]
+    num_points = 0
+    decaying = stamps.size > 0
+    for x in range(2,sdr.size): 
+        sx = sdr[x]
+        xv = sx * (sx-1) * (sx-2) // 6
+        for y in range(1,x):
+            sy = sdr[y]
+            yv = xv + sy * (sy-1) // 2 
+            if not _kept(yv, keep):
+                continue
+            for z in range(y):
+                addr = (yv + sdr[z]) % msize
+                if decaying:
+                    _cell(value_map, stamps, addr, epoch, decay)
+                value_map[addr] += value
+                num_points += 1
+    return num_points
+
+@numba.njit
+def _value_query3(sdr, value_map, stamps, epoch, decay, keep): 
+    msize = value_map.shape[0]
+    for xyz, addr in addr3_sampled(sdr, keep):
+        yield xyz, _cell(value_map, stamps, addr % msize, epoch, decay)
+
+@numba.njit(cache = True)
+def _value_score3(sdr, value_map, stamps, epoch, decay, keep): 
+    msize = value_map.shape[0]
+    num_points = 0
+    vsum = 0.0
+    decaying = stamps.size > 0
+    for x in range(2,sdr.size): 
+        sx = sdr[x]
+        xv = sx * (sx-1) * (sx-2) // 6
+        for y in range(1,x):
+            sy = sdr[y]
+            yv = xv + sy * (sy-1) // 2 
+            if not _kept(yv, keep):
+                continue
+            for z in range(y):
+                addr = (yv + sdr[z]) % msize
+                if decaying:
+                    _cell(value_map, stamps, addr, epoch, decay)
+                num_points += 1
+                vsum += value_map[addr]
+    if num_points == 0:
+        return 0.0
+    return vsum / num_points
+
+@numba.njit(nogil = True, cache = True)
+def _value_add_many(sdrs, value_map, values, stamps, epoch, decay, order, keep):
+    """
+    adds every row of sdrs with the matching value. 
+    On decaying maps each row is a tick, row i is added at epoch + i + 1
+    returns number of points added for each row
+    """
+    num_points = np.zeros(sdrs.shape[0], dtype = np.int64)
+    step = 1 if stamps.size else 0
+    for i in range(sdrs.shape[0]):
+        epoch += step
+        if order == 3:
+            num_points[i] = _value_add3(sdrs[i], value_map, values[i], stamps, epoch, decay, keep)
+        else:
+            num_points[i] = _value_add2(sdrs[i], value_map, values[i], stamps, epoch, decay)
+    return num_points
+
+@numba.njit(nogil = True, cache = True)
+def _value_score_many(sdrs, value_map, stamps, epoch, decay, order, keep):
+    scores = np.zeros(sdrs.shape[0], dtype = np.float64)
+    for i in range(sdrs.shape[0]):
+        if order == 3:
+            scores[i] = _value_score3(sdrs[i], value_map, stamps, epoch, decay, keep)
+        else:
+            scores[i] = _value_score2(sdrs[i], value_map, stamps, epoch, decay)
+    return scores
+
+@numba.njit(nogil = True, cache = True)
+def _value_query_into(sdr, value_map, stamps, epoch, decay, order, keep, points, values):
+    """
+    fills points with positions within sdr and values with the map's values of each 
+    bit pair (or sampled triple) in sdr. Returns number of points filled
+    """
+    msize = value_map.shape[0]
+    count = 0
+    if order == 3:
+        for x in range(2,sdr.size): 
+            sx = sdr[x]
+            xv = sx * (sx-1) * (sx-2) // 6
+            for y in range(1,x):
+                sy = sdr[y]
+                yv = xv + sy * (sy-1) // 2 
+                if not _kept(yv, keep):
+                    continue
+                for z in range(y):
+                    points[count, 0] = x
+                    points[count, 1] = y
+                    points[count, 2] = z
+                    values[count] = _cell(value_map, stamps, (yv + sdr[z]) % msize, epoch, decay)
+                    count += 1
+    else:
+        for x in range(1,sdr.size):
+            xv = sdr[x]*(sdr[x] - 1) // 2
+            for y in range(x):
+                points[count, 0] = x
+                points[count, 1] = y
+                values[count] = _cell(value_map, stamps, (xv + sdr[y]) % msize, epoch, decay)
+                count += 1
+    return count
+
+@numba.njit(nogil = True, cache = True)
+def _value_query_many(sdrs, value_map, stamps, epoch, decay, order, keep, points, values):
+    counts = np.zeros(sdrs.shape[0], dtype = np.int64)
+    for i in range(sdrs.shape[0]):
+        counts[i] = _value_query_into(sdrs[i], value_map, stamps, epoch, decay, order, keep, points[i], values[i])
+    return counts
+
+@numba.njit(nogil = True, cache = True)
+def _value_anomalous(sdr, value_map, stamps, epoch, decay, order, keep, points, values, m, mean):
+    """
+    queries sdr into points/values then moves the m values furthest from mean 
+    to the front, in decreasing order of distance. Returns how many were moved (<= m)
+    """
+    count = _value_query_into(sdr, value_map, stamps, epoch, decay, order, keep, points, values)
+    m = min(m, count)
+    # partial selection sort, m is small so only m passes over the points
+    for k in range(m):
+        best = k
+        for i in range(k + 1, count):
+            if abs(values[i] - mean) > abs(values[best] - mean):
+                best = i
+        if best != k:
+            values[k], values[best] = values[best], values[k]
+            for j in range(points.shape[1]):
+                points[k, j], points[best, j] = points[best, j], points[k, j]
+    return m
+
 @numba.jit
 def test_addr3(sdrs): 
     naddrs = 0
@@ -156,7 +553,7 @@ def test_addr2(sdrs):
 def test_map_query2(sdrs, vmap):
     results = []
     for sdr in sdrs:
-        qresult = _value_score2(sdr, vmap)
+        qresult = _value_score2(sdr, vmap, np.zeros(0, dtype = np.uint32), 0, 1.0)
 
         results.append(qresult)
     return results
@@ -182,3 +579,28 @@ if __name__ == "__main__":
     t = int((time() - t) * 1000)
     print(f"{num_sdrs} of size/len {SDR_SIZE}/{SDR_LEN} added in {t} ms")
     qresults = test_map_query2(sdrs[:100], vmap.vmap)
+
+    dmap = ValueCorrMap(sdr_size = SDR_SIZE, decay = 0.999)
+    t = time()
+    for i in range(num_sdrs):
+        dmap.add(sdrs[i],np.random.randint(1,10))
+    t = int((time() - t) * 1000)
+    print(f"{num_sdrs} of size/len {SDR_SIZE}/{SDR_LEN} added with decay {dmap.decay} in {t} ms")
+
+    # Pairs vs triples throughput, batched. All maps get the same memory budget, the canonical pairs map's
+    MEM_BYTES = MAP_SIZE * 4
+    num_sdrs = 100_000
+    sdrs = sdrs[:num_sdrs]
+    values = np.random.randint(1, 10, size = num_sdrs)
+    for order, sample in ((2, 1.0), (3, 1.0), (3, 0.25), (3, 0.05)):
+        cmap = ValueCorrMap(sdr_size = SDR_SIZE, mem_size = MEM_BYTES, order = order, sample = sample)
+        cmap.add_many(sdrs[:10], values[:10]) # compile
+        cmap.score_many(sdrs[:10])
+        t = time()
+        points, totals = cmap.add_many(sdrs, values)
+        t = time() - t
+        q = time()
+        scores = cmap.score_many(sdrs)
+        q = time() - q
+        print(f"order {order} sample {sample:.2f}: {(points / values).mean():.0f} points/sdr, map size {cmap.vmap.size}, " 
+              f"add {int(num_sdrs / t)} sdrs/sec, score {int(num_sdrs / q)} sdrs/sec")
@@ -21,8 +21,16 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import numpy as np
 import numba
+import sdr_metrics as metrics
 
-@numba.jit
+_METRICS = metrics.ENABLED   # probes are compiled out unless SDR_METRICS is set
+
+def _record(op, t, pairs):
+    metrics.phase(op + ".kernel", t)
+    metrics.observe(op + ".pairs", pairs)
+    metrics.count(op + ".calls")
+
+@numba.njit(cache = True)
 def xaddr(x):
     addr = []
     for i in range(1,len(x)):
@@ -30,7 +38,7 @@ def xaddr(x):
             addr.append(x[i]*(x[i]-1)//2 + x[j])
     return addr
 
-@numba.jit
+@numba.njit(cache = True)
 def xyaddr(N,x,y):
     addr = []
     for ax in x:
@@ -38,7 +46,7 @@ def xyaddr(N,x,y):
             addr.append(ax*N + ay)
     return addr
 
-@numba.jit
+@numba.njit(cache = True)
 def store_xy(mem, x, y):
     """
     Stores Y under key X
@@ -48,7 +56,7 @@ def store_xy(mem, x, y):
         for j in y:
             mem[addr,j] += 1
 
-@numba.jit
+@numba.njit(cache = True)
 def store_xyz(mem, x, y, z): 
     """
     Stores X, Y, Z triplet in mem
@@ -59,14 +67,14 @@ def store_xyz(mem, x, y, z):
             for az in z:
                 mem[ax, ay, az] += 1
 
-@numba.jit
+@numba.njit(cache = True)
 def query(mem, P, x):
     sums = np.zeros(mem.shape[1],dtype=np.uint32)
     for addr in xaddr(x):
         sums += mem[addr]
     return sums2sdr(sums, P)
 
-@numba.jit
+@numba.njit(cache = True)
 def queryZ(mem, P, x, y):
     N = mem.shape[0]
     sums = np.zeros(N, dtype = np.uint32)
@@ -75,25 +83,25 @@ def queryZ(mem, P, x, y):
             sums += mem[ax, ay, :]
     return sums2sdr(sums, P)
 
-@numba.jit
+@numba.njit(cache = True)
 def queryX(mem, P, y, z):
     N = mem.shape[0]
     sums = np.zeros(N, dtype = np.uint32)
     for ay in y:
         for az in z:
             sums += mem[:, ay, az]
-    return sums2addr(sums, P)
+    return sums2sdr(sums, P)
 
-@numba.jit
+@numba.njit(cache = True)
 def queryY(mem, P, x, z):
     N = mem.shape[0]
     sums = np.zeros(N, dtype = np.uint32)
     for ax in x:
         for az in z:
             sums += mem[ax,:,az]
-    return sums2addr(sums,P)
+    return sums2sdr(sums, P)
 
-@numba.jit
+@numba.njit(cache = True)
 def sums2sdr(sums, P):
     # this does what binarize() does in C
     ssums = sums.copy()
@@ -108,20 +116,30 @@ class TriadicMemory:
     def __init__(self, N, P):
         self.mem = np.zeros((N,N,N), dtype=np.uint8)
         self.P = P
+        self.writes = 0     # bumped by every store, invalidates cached query results
 
     def store(self, x, y, z):
+        if _METRICS: t = metrics.clock()
+        self.writes += 1
         store_xyz(self.mem, x, y, z)
+        if _METRICS: _record("triadic.store", t, len(x) * len(y))
 
     def query(self, x, y, z = None): 
         # query for either x, y or z. 
         # The queried member must be provided as None
         # the other two members have to be encoded as sorted sparse SDRs
+        if _METRICS: t = metrics.clock()
+        found = None    # no member is None, nothing to query
         if z is None:
-            return queryZ(self.mem, self.P, x, y)
+            found = queryZ(self.mem, self.P, x, y)
         elif x is None:
-            return queryX(self.mem, self.P, y, z)
+            found = queryX(self.mem, self.P, y, z)
         elif y is None:
-            return queryY(self.mem, self.P, x, z)
+            found = queryY(self.mem, self.P, x, z)
+        if _METRICS and found is not None:
+            a, b = [m for m in (x, y, z) if m is not None]
+            _record("triadic.query", t, len(a) * len(b))
+        return found
 
 
 class DiadicMemory:
@@ -135,14 +153,21 @@ class DiadicMemory:
         """
         self.mem = np.zeros((N*(N-1)//2, N), dtype = np.uint8)
         self.P = P
+        self.writes = 0     # bumped by every store, invalidates cached query results
 
     def store(self, x, y):
+        if _METRICS: t = metrics.clock()
+        self.writes += 1
         store_xy(self.mem, x, y)
+        if _METRICS: _record("diadic.store", t, len(x) * (len(x) - 1) // 2)
 
     def query(self, x):
-        return query(self.mem, self.P, x)
+        if _METRICS: t = metrics.clock()
+        found = query(self.mem, self.P, x)
+        if _METRICS: _record("diadic.query", t, len(x) * (len(x) - 1) // 2)
+        return found
 
-@numba.jit
+@numba.njit(cache = True)
 def randomSDR(count, N=1000,P=10): 
     res = np.zeros((count, P), dtype = np.uint16)
     x = np.arange(N) 